@@ -0,0 +1,239 @@
+# Trivia - TCP Quiz Game POC [2.0.0]
+# By Martin Alebachew
+# BENCH.PY
+# #####
+
+from protocol import *
+from trivia_client import *
+
+# Benchmark default settings - see parse_args
+DEFAULTS = {
+    "bots": 1000,  # Concurrent bot connections
+    "games": 1,  # Games played by every bot, over a single connection
+    "room": 2,  # Players in a game - has to match the server room size
+    "think": 1.0,  # Average time to answer a question (seconds)
+    "ramp": 5.0,  # Time over which bots connect (seconds)
+    "patience": 30.0,  # Time a bot keeps searching before it gives up (seconds)
+    "host": "127.0.0.1",  # Server IP address
+    "port": PORT,  # Server port
+    "framed": True,  # Use length-prefixed frames
+    "compact": True,  # Ask for the compact wire format - the local question bank is synced with the server bank
+}
+
+
+# Benchmark classes
+class Stats:
+    def __init__(self):
+        """
+        Measurements collected by all bots.
+        """
+
+        self.games = 0  # Games played to the end, counted by each of their players
+        self.unmatched = 0  # Searches given up on after the patience time
+        self.errors = {}  # Failed games by error name
+        self.match_wait = []  # Time from search query to first question (seconds)
+        self.question = []  # Time from the last answer of a game to its next question, without QD (seconds)
+        self.results = []  # Time from the last answer of a game to its results, without QD (seconds)
+        self.answered = {}  # Time of the last answer sent by any bot of a game, by (game key, question number)
+
+    def error(self, e) -> None:
+        """
+        Counts a failed game.
+
+        :param e: error raised during the game
+        :type e: Exception
+        """
+
+        name = type(e).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+# Benchmark static functions
+def percentiles(samples) -> str:
+    """
+    Returns a row of p50, p90, p99 and max of a list of durations, in milliseconds.
+
+    :param samples: durations (seconds)
+    :type samples: list[float]
+    """
+
+    if not samples:
+        return "no samples"
+
+    samples = sorted(samples)
+    row = [samples[min(int(len(samples) * p), len(samples) - 1)] for p in (0.5, 0.9, 0.99)] + [samples[-1]]
+    return "".join(f"{v * 1000:10.1f}" for v in row)
+
+
+async def play_game(bid, client, settings, stats) -> None:
+    """
+    Plays a single game as a bot - searches a game in the topic of its room (bots 0 and 1, 2 and 3, ... in duels),
+    answers every question after the think time, and records latencies.
+    Bots of the same game share the time of its last answer, which the server waits for before moving on.
+    A bot that gives up searching cancels, which closes its connection.
+
+    :param bid: bot id
+    :param client: connected bot client
+    :param settings: benchmark settings dict
+    :param stats: shared measurements
+    :type bid: int
+    :type client: AsyncTriviaClient
+    :type settings: dict
+    :type stats: Stats
+    """
+
+    topic = TOPICS[bid // settings["room"] % len(TOPICS)]
+    start = monotonic()
+    msg = await client.search(topic)
+
+    while msg is None or msg.code == "N":
+        if not client.alive():
+            raise ConnectionResetError
+
+        if monotonic() - start > settings["patience"]:
+            await client.cancel()
+            stats.unmatched += 1
+            return
+
+        msg = await client.recv(DW + TIMEOUT)
+        if msg is None:  # Search again, just like the game client
+            msg = await client.search(topic)
+
+    stats.match_wait.append(monotonic() - start)
+
+    # Every bot of a game is asked the same first question - told apart by the rival names in a duel
+    rival = msg.fields[-1]
+    game = (topic, *msg.fields[:-1], frozenset((client.name, rival)) if settings["room"] == 2 else rival)
+
+    i = 0
+    while msg.code == "Q":
+        await asyncio.sleep(random.uniform(0.5, 1.5) * settings["think"])
+
+        # The server waits for the answers of the whole game, so delivery is measured from the last one
+        stats.answered[game, i] = max(stats.answered.get((game, i), 0), monotonic())
+        msg = await client.answer(random.randint(1, 4), TIMEOUT + ANS + TIMEOUT)
+        if msg is None:
+            raise Error.Client.UnexpectedResponse
+        (stats.question if msg.code == "Q" else stats.results).append(monotonic() - stats.answered[game, i] - QD)
+        i += 1
+
+    if msg.code != "R":
+        raise Error.Client.UnexpectedResponse
+    stats.games += 1
+
+
+async def run_bot(bid, settings, stats) -> None:
+    """
+    Bot main function - waits for its turn in the ramp up, then plays its games over a single connection.
+    The bot reconnects only if its connection was closed.
+
+    :param bid: bot id
+    :param settings: benchmark settings dict
+    :param stats: shared measurements
+    :type bid: int
+    :type settings: dict
+    :type stats: Stats
+    """
+
+    await asyncio.sleep(settings["ramp"] * bid / settings["bots"])
+
+    client = AsyncTriviaClient(f"bot{bid}", settings["host"], settings["port"], settings["framed"], settings["bank"])
+
+    for _ in range(0, settings["games"]):
+        try:
+            if not client.alive():
+                await client.connect()
+            await play_game(bid, client, settings, stats)
+        except (OSError, Error.Client.ConnectionFailed, Error.Client.UnexpectedResponse,
+                Error.Protocol.UnknownMessageCode) as e:
+            stats.error(e)
+            client.close()
+
+    client.close()
+
+
+async def run_bench(settings) -> (Stats, float):
+    """
+    Runs all bots and returns their measurements and the benchmark duration.
+
+    :param settings: benchmark settings dict
+    :type settings: dict
+    """
+
+    stats = Stats()
+    start = monotonic()
+    await asyncio.gather(*(run_bot(bid, settings, stats) for bid in range(0, settings["bots"])))
+    return stats, monotonic() - start
+
+
+def report(settings, stats, elapsed) -> None:
+    """
+    Prints the benchmark results.
+
+    :param settings: benchmark settings dict
+    :param stats: bots measurements
+    :param elapsed: benchmark duration (seconds)
+    :type settings: dict
+    :type stats: Stats
+    :type elapsed: float
+    """
+
+    matches = stats.games // settings["room"]
+    print(f"{settings['bots']} bots, {matches} matches in {elapsed:.1f}s - {matches / elapsed:.2f} matches/s")
+    print(f"Unmatched searches: {stats.unmatched}")
+    print(f"Failed games: {sum(stats.errors.values())} {stats.errors if stats.errors else ''}")
+    print(f"Question delivery and results are measured from the last answer of a game, "
+          f"without the fixed server delay of {QD * 1000:.0f} ms")
+    print(f"{'(ms)':20}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    print(f"{'Matchmaking wait':20}{percentiles(stats.match_wait)}")
+    print(f"{'Question delivery':20}{percentiles(stats.question)}")
+    print(f"{'Results':20}{percentiles(stats.results)}")
+
+
+def parse_args(args) -> dict:
+    """
+    Parses benchmark command line arguments -
+    [bots=N] [games=N] [room=N] [think=SECONDS] [ramp=SECONDS] [patience=SECONDS] [host=IP] [port=PORT] [unframed]
+    [text] and returns a settings dict.
+
+    :param args: command line arguments, without the program name
+    :type args: list[str]
+    :raises Error.Client.InvalidArgs: if an argument is not recognized
+    """
+
+    settings = dict(DEFAULTS)
+
+    for arg in args:
+        key, _, value = arg.partition("=")
+
+        try:
+            if arg == "unframed":
+                settings["framed"] = False
+            elif arg == "text":
+                settings["compact"] = False
+            elif key in ("bots", "games", "room", "port"):
+                settings[key] = int(value)
+            elif key in ("think", "ramp", "patience"):
+                settings[key] = float(value)
+            elif key == "host" and value:
+                settings[key] = value
+            else:
+                raise Error.Client.InvalidArgs
+        except ValueError:
+            raise Error.Client.InvalidArgs
+
+    return settings
+
+
+def main():
+    settings = parse_args(sys.argv[1:])
+    settings["bank"] = load_bank() if settings["compact"] else None  # Shared by all bots
+    raise_fd_limit()
+
+    print(f"Running {settings['bots']} bots against {settings['host']}:{settings['port']}...")
+    stats, elapsed = asyncio.run(run_bench(settings))
+    report(settings, stats, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,33 @@
 # #####
 
 from protocol import *
+from trivia_client import *
 from typing import Union
 import math
+import os
+import queue
 import random
-import socket
 from time import sleep
 import cv2
 import pygame
 from string import ascii_letters
+import unicodedata
 
 # Client constants
-SID = "S"  # Server representation in logs
+FRAMED = True  # Use length-prefixed frames - the server detects the wire mode of every connection
 SCREEN_SIZE = (1080, 720)  # [DO NOT ALTER] Screen dimensions
+TIMER_AREA = (934, 146, 75, 74)  # Timer of the question screen - the only area the low time picture changes
+PICTURES = "assets/pictures"  # Pictures directory, preloaded by Pictures
+PICTURE_TYPES = (".png", ".jpg", ".jpeg", ".bmp")
+VIDEO_QUEUE = 30  # Frames decoded ahead of playback
+FONTS = "assets/fonts/Ploni"  # Fonts directory, a file per weight
+TEXT_CACHE = 256  # Rendered text surfaces kept by Fonts
+IDLE_TICK = 250  # Longest wait for events while the screen is still (milliseconds)
+WAKE = pygame.USEREVENT  # Event posted by other threads to wake the mainloop after drawing
 ANS_CENT = [(792, 452), (289, 452), (792, 567), (289, 567)]
-HEB_CHARS = "אבגדהוזחטיכלמנסעפצקרשתץןםףך"
-CONT_SEQ = " ־–-:״\"',׳()"
+HEB_CHARS = frozenset(map(chr, range(0x05D0, 0x05EB)))  # Hebrew letters, including final forms
+MIRROR = str.maketrans("()[]{}<>", ")(][}{><")  # Brackets mirrored in right-to-left text
+BIDI_CACHE = 1024  # Shaped texts memoized by bidi
 
 
 # GUI static functions
@@ -105,35 +117,6 @@ def chosen_answer(pos) -> Union[int, None]:
             return 3
 
 
-def establish_connection(name, ip="127.0.0.1", port=PORT) -> socket.socket:
-    """
-    Connects to the server and returns a socket.
-
-    :param name: client nickname
-    :param ip: server IP address
-    :param port: server port
-    :type name: str
-    :type ip: str
-    :type port: int
-    """
-
-    s = socket.socket()
-
-    try:
-        s.connect((ip, port))
-        msg = build_message("I", name)
-        send_message(s, SID, msg)
-        rsp = recv_message(s, SID)
-        if rsp.code != "W":
-            raise Error.Client.UnexpectedResponse
-
-    except socket.error as e:
-        log(SID, "Error: {}".format(e))
-        raise Error.Client.ConnectionFailed
-
-    return s
-
-
 def random_name() -> str:
     """
     Returns a random nickname.
@@ -154,74 +137,110 @@ def random_name() -> str:
     return names[random.randint(0, len(names) - 1)]  # Return a random name from the list above
 
 
-def hebrew_proof(text) -> str:
+@functools.lru_cache(maxsize=BIDI_CACHE)
+def bidi(text) -> str:
     """
-    Returns a reformatted string for pygame to view in hebrew.
-    KNOWN BUG with leading AND trailing cont_chars around non-hebrew text.
+    Returns text in visual order, for pygame to draw Hebrew right-to-left, in O(len(text)). Results are memoized.
+    Text with Hebrew is a right-to-left paragraph - Hebrew letters are right-to-left, other letters and digits
+    left-to-right, and every other character takes the direction of the text around it if both sides agree,
+    right-to-left otherwise (also at the edges). Points stay after their letter, and right-to-left brackets are mirrored.
+    Text without Hebrew is returned as is.
 
-    :param text: text to reformat
+    :param text: text in logical order
     :type text: str
     """
 
-    spl = []
-    ts = ""
-    heb_seq = False
-    heb_dec = False
+    if HEB_CHARS.isdisjoint(text):
+        return text
 
+    # Split to clusters - a character followed by its combining points
+    clusters = []
     for ch in text:
-        if ch in HEB_CHARS or (ch in CONT_SEQ and heb_seq):  # if in hebrew
-            if not heb_seq:  # if prev seq not in hebrew
-                spl.append(ts)  # save not reversed
-                ts = ""
+        if clusters and unicodedata.combining(ch):
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
 
-            heb_seq = True
-            heb_dec = True  # hebrew somewhere in text
-            ts += ch
+    # Strong directions - True for right-to-left, False for left-to-right, None for neutral
+    rtl = [True if c[0] in HEB_CHARS else False if c[0].isalnum() else None for c in clusters]
 
-        else:  # if not in hebrew
-            if heb_seq:  # if prev seq in hebrew
-                spl.append(ts[::-1])  # save reversed
-                ts = ""
+    # Resolve neutral runs by their surrounding strong directions
+    i = 0
+    while i < len(rtl):
+        if rtl[i] is not None:
+            i += 1
+            continue
 
-            heb_seq = False
-            ts += ch
+        j = i
+        while j < len(rtl) and rtl[j] is None:
+            j += 1
 
-    if ts != "":  # save last sequence
-        spl.append(ts[:: -1 if heb_seq else 1])
+        before = rtl[i - 1] if i > 0 else True
+        after = rtl[j] if j < len(rtl) else True
+        rtl[i:j] = [before or after] * (j - i)
+        i = j
 
-    if heb_dec:  # if there's hebrew in text - reverse order of sequences
-        spl.reverse()
+    # Reverse the order of the runs, and the clusters of right-to-left runs
+    runs = []
+    for run_rtl, run in itertools.groupby(zip(rtl, clusters), key=lambda pair: pair[0]):
+        run = [c for _, c in run]
+        runs.append("".join(reversed(run)).translate(MIRROR) if run_rtl else "".join(run))
 
-    return "".join(spl)
+    runs.reverse()
+    return "".join(runs)
+
+
+def preshape(bank) -> dict[str, str]:
+    """
+    Shapes every question and answer of a question bank once,
+    and returns their visual order by their text, so drawing questions never shapes text.
+
+    :param bank: question bank
+    :type bank: QuestionBank
+    """
+
+    shaped = {}
+    for i in range(0, len(bank)):
+        q = bank.question(i)
+        for text in (q.q, q.a1, q.a2, q.a3, q.a4):
+            shaped[text] = bidi.__wrapped__(text)  # Leave the memo to live text
+
+    return shaped
 
 
 class TextboxMgr:
-    def __init__(self, screen, value="", fontsize=20, pos=(0, 0)):
+    def __init__(self, screen, font, value="", pos=(0, 0), dirty=None):
         """
         Represents a textbox on settings page.
 
         :param screen: main surface
+        :param font: inner text font
         :param value: default text value
-        :param fontsize: inner text font size
         :param pos: position on screen
+        :param dirty: changed screen areas to mark the textbox in, if any
         :type screen: pygame.Surface
+        :type font: pygame.font.Font
         :type value: str
-        :type fontsize: int
         :type pos: (int, int)
+        :type dirty: collections.deque
         """
 
         self.screen = screen
+        self.dirty = dirty
         self.value = value
         self.field_color = (61, 65, 118)
 
-        self.font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", fontsize)
+        self.font = font
         self.input_rect = pygame.Rect(pos[0], pos[1], 416, 58)
 
     def blit(self):
         # Draw textbox
-        pygame.draw.rect(self.screen, self.field_color, self.input_rect, 0)
+        rect = pygame.draw.rect(self.screen, self.field_color, self.input_rect, 0)
         text_surface = self.font.render(self.value, True, (255, 255, 255))
-        self.screen.blit(text_surface, (self.input_rect.x + 10, self.input_rect.y + 7))
+        text_rect = self.screen.blit(text_surface, (self.input_rect.x + 10, self.input_rect.y + 7))
+
+        if self.dirty is not None:
+            self.dirty.append(rect.union(text_rect))
 
     def highlight(self):
         # Color textbox
@@ -234,91 +253,264 @@ class TextboxMgr:
         self.blit()
 
 
+class Fonts:
+    def __init__(self, path=FONTS, size=TEXT_CACHE):
+        """
+        Registry of fonts by weight and size, each loaded from its file once,
+        and a bounded cache of rendered text surfaces by text, font and color,
+        so timer digits, headers and answers aren't rasterized again every time they are drawn.
+        Cached surfaces are shared - they are only blitted, never drawn on.
+
+        :param path: fonts directory
+        :param size: maximum number of cached text surfaces
+        :type path: str
+        :type size: int
+        """
+
+        self.path = path
+        self.get = functools.lru_cache(maxsize=None)(self._load)
+        self.render = functools.lru_cache(maxsize=size)(self._render)
+
+    def _load(self, weight, size) -> pygame.font.Font:
+        """
+        Loads a font. Use get, which loads every weight and size once.
+
+        :param weight: font weight - file name without extension
+        :param size: font size
+        :type weight: str
+        :type size: int
+        """
+
+        return pygame.font.Font(os.path.join(self.path, f"{weight}.ttf"), size)
+
+    def _render(self, text, font, color=(255, 255, 255)) -> pygame.Surface:
+        """
+        Renders antialiased text. Use render, which returns cached surfaces.
+
+        :param text: text to render
+        :param font: font from get
+        :param color: text color
+        :type text: str
+        :type font: pygame.font.Font
+        :type color: (int, int, int)
+        """
+
+        return font.render(text, True, color)
+
+
+class Pictures:
+    def __init__(self, path=PICTURES):
+        """
+        Surfaces of every picture in a directory, keyed by file name without extension.
+        Pictures are loaded from disk and converted to the display pixel format once,
+        so screens are drawn from memory, and blits don't convert pixels every time.
+        The display mode has to be set first.
+
+        :param path: pictures directory
+        :type path: str
+        """
+
+        self.surfaces = {}
+
+        for file in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(file)
+            if ext.lower() not in PICTURE_TYPES:
+                continue
+
+            surface = pygame.image.load(os.path.join(path, file))
+            if surface.get_flags() & pygame.SRCALPHA:  # Keep per-pixel transparency
+                self.surfaces[name] = surface.convert_alpha()
+            else:
+                self.surfaces[name] = surface.convert()
+
+    def __getitem__(self, name) -> pygame.Surface:
+        return self.surfaces[name]
+
+
+class Video:
+    def __init__(self, path):
+        """
+        Video decoded on a background thread into a bounded queue of display-converted surfaces.
+        Every frame is wrapped from its decoded image buffer and copied once by converting it to the display format,
+        on the decoder thread, so the main thread only blits it.
+        Videos loop by rewinding the capture at the end of the file - they are decoded again on every loop rather than
+        kept in memory, as even the short clips take hundreds of megabytes once decoded.
+
+        :param path: video file path
+        :type path: str
+        """
+
+        self.path = path
+        capture = cv2.VideoCapture(path)
+        self.fps = capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+
+        self.last = None  # Last returned frame, repeated if the decoder falls behind
+        self.frames = None  # Queue of decoded frames
+        self.thread = None  # Decoder thread
+
+    def start(self) -> None:
+        """
+        Starts playing the video from the beginning.
+        """
+
+        self.frames = queue.Queue(maxsize=VIDEO_QUEUE)
+        self.thread = StoppableThread(self.decode)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the decoder thread, if running.
+        """
+
+        if self.thread:
+            self.thread.stop()
+            self.thread = None
+
+    def decode(self) -> None:
+        """
+        Decoder thread target function.
+        """
+
+        thread, frames = self.thread, self.frames  # This run's own, in case the video is restarted
+        capture = cv2.VideoCapture(self.path)
+        decoded = False
+
+        while not thread.stopped():
+            success, image = capture.read()
+
+            if not success:
+                if not decoded:  # Nothing to decode
+                    break
+
+                capture.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Rewind instead of reopening the file
+                continue
+
+            decoded = True
+            surface = pygame.image.frombuffer(image, image.shape[1::-1], "BGR").convert()
+
+            while not thread.stopped():
+                try:
+                    frames.put(surface, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+        capture.release()
+
+    def next_frame(self) -> Union[pygame.Surface, None]:
+        """
+        Returns the next frame to display, without waiting for the decoder.
+        """
+
+        try:
+            self.last = self.frames.get_nowait()
+        except queue.Empty:
+            pass
+
+        return self.last
+
+
 class MatchThread(StoppableThread):
-    def __init__(self, gui, sock, msg):
-        self.sock = sock
-        self.msg = msg
+    def __init__(self, gui, conn, topic):
+        self.conn = conn
+        self.topic = topic
         self.gui = gui
         super().__init__(self.conn_f)  # Initialize a Stoppable Thread with conn_f as target function
 
     def conn_f(self) -> None:
         """
         Thread target function to request a match and update the displayed counter.
-
-        :param sock: connected socket
-        :param msg: message string
-        :type sock: socket.socket
-        :type msg: str
+        Once stopped, no response is handed to the GUI, which has already dropped the connection -
+        the thread cancels the search and closes the connection itself.
         """
 
         retry = True
 
-        while retry:
-            send_message(self.sock, SID, self.msg)
-            rsp = recv_message(self.sock, SID, TIMEOUT)
+        while retry and not self.stopped():
+            rsp = self.conn.search(self.topic)
 
-            if rsp.code == "Q":
-                retry = False
-                self.gui.qrsp = rsp
-                self.gui.against = rsp.fields[5]
-                self.gui.state = "question_flag"  # Flag main thread to load a question
+            if self.stopped():  # Canceled while waiting for the response
+                break
+
+            elif rsp and rsp.code == "Q":
+                self.found(rsp)
+                return
 
-            elif rsp.code == "N":
+            elif rsp and rsp.code == "N":
                 wait = int(rsp.fields[0])
-                font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 40)
-                text = font.render(f"{wait}...", True, (255, 255, 255))
+                fonts = self.gui.fonts
+                text = fonts.render(f"{wait}...", fonts.get("Regular", 40))
                 self.gui.play_on_vid["match_seconds_counter"] = (text, (10, 670))
 
-                while wait > 0:
+                while wait > 0 and not self.stopped():
                     for i in range(0, 100):
                         sleep(0.01)
-                        msg = recv_message(self.sock, SID, 0.001)
+                        msg = self.conn.recv(0.001)
+                        if self.stopped():  # Checked before handling any response
+                            break
                         if msg and msg.code == "Q":
-                            self.gui.qrsp = msg
-                            self.gui.against = msg.fields[5]
-                            self.gui.state = "question_flag"  # Flag main thread to load a question
+                            self.found(msg)
                             return
-
-                    if self.stopped():
-                        send_message(self.sock, SID, build_message("C"))
-                        retry = False
-                        break
                     else:
                         wait -= 1
-                        font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 40)
-                        text = font.render(f"{wait}...", True, (255, 255, 255))
+                        text = fonts.render(f"{wait}...", fonts.get("Regular", 40))
                         self.gui.play_on_vid["match_seconds_counter"] = (text, (10, 670))
 
-                sleep(1)
+                if not self.stopped():
+                    sleep(1)
 
             else:
                 retry = False
                 print(f"Client expected \"Q\" or \"N\" message from server,"
-                      f"instead got \"{rsp.code}\" response. Loading error screen...")
-                self.sock.close()
+                      f"instead got \"{rsp.code if rsp else None}\" response. Loading error screen...")
+                self.gui.close_connection()
                 self.gui.raise_error()
 
+        if self.stopped():  # The server closes canceled connections - the GUI may already use a new one
+            try:
+                self.conn.cancel()
+            except OSError:
+                self.conn.close()
+
+    def found(self, rsp) -> None:
+        """
+        Hands the first question of a found game to the GUI, and flags the main thread to load it.
+
+        :param rsp: question message
+        :type rsp: Message
+        """
+
+        self.gui.qrsp = rsp
+        self.gui.against = rsp.fields[5]
+        self.gui.state = "question_flag"  # Flag main thread to load a question
+        self.gui.wake()
+
 
 class Gui:
     """ GUI Manager Class """
     def __init__(self):
         # Initialize class variables:
         self.video = None  # [Video Functionality] Video object for mainloop
-        self.fps = None  # [Video Functionality] Goal fps variable for mainloop
+        self.videos = {}  # [Video Functionality] Opened videos by path, so a video is only probed once
         self.clock = None  # [Video Functionality] Clock variable for mainloop
-        self.fc = None  # [Video Functionality] Frames count variable for mainloop
-        self.fm = None  # [Video Functionality] Goal fps variable for mainloop
         self.playvid = False  # [Video Functionality] False if there's no video to play, or the video's path
         self.play_on_vid = {}  # [Video Functionality] Video overlay items
+        self.dirty = collections.deque()  # [Mainloop] Changed screen areas, pushed to the display by the mainloop
+        self.fonts = Fonts()  # [Mainloop] Loaded fonts and rendered text
+        self.shaped = {}  # [Mainloop] Pre-shaped questions and answers of the local question bank, see shape
 
         self.qrsp = None  # [Question Fetching] Temporary question response variable
         self.qc = 0  # [Question Fetching] Question count variable
         self.qt = ANS  # [Question Fetching] Question timer variable
         self.against = None  # [Question Fetching] Rival nickname variable
 
-        self.sock = None  # [Network] Connection socket
+        self.conn = None  # [Network] Server connection, kept open between games
         self.name = random_name()  # [Network] Nickname
         self.ip = "127.0.0.1"  # [Network] Server IP address
+        self.cache = BankCache()  # [Network] Question bank cache, synced with the server bank on connect
+        self.bank = None  # [Network] Local question bank, so the server can send questions by index
 
         self.conn_t = None  # [Matching] Match searching thread
         self.chosen_ans = False  # [Matching] Flag to avoid double answering
@@ -332,19 +524,23 @@ class Gui:
         print("Initializing...")
         pygame.init()
 
-        self.screen.fill((140, 82, 255))  # BG color behind textbox
-        self.namemgr = TextboxMgr(self.screen, self.name, 40, (164, 354))
-        self.ipmgr = TextboxMgr(self.screen, self.ip, 40, (164, 433))
+        self.mark(self.screen.fill((140, 82, 255)))  # BG color behind textbox
+        self.namemgr = TextboxMgr(self.screen, self.fonts.get("Regular", 40), self.name, (164, 354), self.dirty)
+        self.ipmgr = TextboxMgr(self.screen, self.fonts.get("Regular", 40), self.ip, (164, 433), self.dirty)
+
+        self.pictures = Pictures()  # Preloaded pictures, converted to the display pixel format
+
+        self.bank = self.cache.load()
+        self.shaped = preshape(self.bank) if self.bank else {}  # No cached bank yet - shape questions when drawn
 
         pygame.display.set_caption("Play Trivia!")
-        icon = pygame.image.load("assets/pictures/icon.png")
-        pygame.display.set_icon(icon)
+        pygame.display.set_icon(self.pictures["icon"])
 
-        self.timer_font = pygame.font.Font("assets/fonts/Ploni/Demibold.ttf", 40)
-        self.question_font = pygame.font.Font("assets/fonts/Ploni/Demibold.ttf", 55)
-        self.answers_font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 40)
-        self.header_font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 55)
-        self.large_header_font = pygame.font.Font("assets/fonts/Ploni/Demibold.ttf", 100)
+        self.timer_font = self.fonts.get("Demibold", 40)
+        self.question_font = self.fonts.get("Demibold", 55)
+        self.answers_font = self.fonts.get("Regular", 40)
+        self.header_font = self.fonts.get("Regular", 55)
+        self.large_header_font = self.fonts.get("Demibold", 100)
 
         self.load_welcome_screen()
         pygame.mixer.init()
@@ -360,16 +556,83 @@ class Gui:
 
         self.state = "error"
         self.load_video("assets/videos/error.mp4")
+        self.wake()
 
     def close_client(self) -> None:
         """
         Properly exit client
         """
 
-        self.sock.close()
+        self.close_connection()
         pygame.quit()
         quit()
 
+    def close_connection(self) -> None:
+        """
+        Closes the server connection, if open.
+        """
+
+        if self.conn:
+            self.conn.close()
+        self.conn = None
+
+    def shape(self, text) -> str:
+        """
+        Returns text in visual order - pre-shaped if it's in the local question bank.
+
+        :param text: text in logical order
+        :type text: str
+        """
+
+        shaped = self.shaped.get(text)
+        return bidi(text) if shaped is None else shaped
+
+    def mark(self, rect) -> None:
+        """
+        Marks a changed screen area, to be pushed to the display by the mainloop.
+        Wakes the mainloop when called from another thread.
+
+        :param rect: changed screen area
+        :type rect: pygame.Rect
+        """
+
+        self.dirty.append(rect)
+        if threading.current_thread() is not threading.main_thread():
+            self.wake()
+
+    def blit(self, surface, pos, area=None) -> None:
+        """
+        Draws a surface, or an area of it, on the screen, and marks the drawn area as changed.
+
+        :param surface: surface to draw
+        :param pos: position on screen
+        :param area: area of the surface to draw, the whole surface if None
+        :type surface: pygame.Surface
+        :type pos: Union[(int, int), pygame.Rect]
+        :type area: pygame.Rect
+        """
+
+        self.mark(self.screen.blit(surface, pos, area))
+
+    def wake(self) -> None:
+        """
+        Wakes the mainloop from waiting for events, so it handles thread flags and changed screen areas right away.
+        """
+
+        pygame.event.post(pygame.event.Event(WAKE))
+
+    def update_display(self) -> None:
+        """
+        Pushes the changed screen areas to the display. If nothing changed - this method has no effect.
+        """
+
+        rects = []
+        while self.dirty:
+            rects.append(self.dirty.popleft())
+
+        if rects:
+            pygame.display.update(rects)
+
     def load_video(self, path, clear=True) -> None:
         """
         Plays a video from a given file path.
@@ -383,12 +646,16 @@ class Gui:
         if clear:
             self.play_on_vid = {}
 
+        if self.video:
+            self.video.stop()
+
+        if path not in self.videos:
+            self.videos[path] = Video(path)
+
         self.playvid = path
-        self.video = cv2.VideoCapture(self.playvid)
-        self.fps = self.video.get(cv2.CAP_PROP_FPS)
-        self.fm = self.video.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.video = self.videos[path]
+        self.video.start()
         self.clock = pygame.time.Clock()
-        self.fc = 0
 
     def stop_video(self) -> None:
         """
@@ -397,6 +664,8 @@ class Gui:
         """
 
         self.playvid = False
+        if self.video:
+            self.video.stop()
 
     def load_question(self) -> None:
         """
@@ -405,9 +674,9 @@ class Gui:
 
         self.stop_video()
         print("Loading question screen...")
-        self.screen.fill((140, 82, 255))
-        sc = pygame.image.load("assets/pictures/question.png")
-        self.screen.blit(sc, (0, 0))
+        self.mark(self.screen.fill((140, 82, 255)))
+        sc = self.pictures["question"]
+        self.blit(sc, (0, 0))
 
         self.qc += 1  # Increment questions counter
         self.qt = ANS  # Reset question timer
@@ -415,13 +684,13 @@ class Gui:
 
         # Load text
         self.load_question_text(str(ANS), self.timer_font, center=(971, 183))
-        self.load_question_text(hebrew_proof(f"משחק נגד {self.against}"), self.header_font, lambda_f=lambda w, h: (1011-w, 60))
-        self.load_question_text(hebrew_proof(f"{self.qc}/{GL}"), self.header_font, pos=(69, 60))
-        self.load_question_text(hebrew_proof(f"שאלה {self.qc}"), self.large_header_font, lambda_f=lambda w, h: (915-w, 120))
-        self.load_question_text(hebrew_proof(self.qrsp.fields[0]), self.question_font, center=(SCREEN_SIZE[0] / 2, 340))
+        self.load_question_text(self.shape(f"משחק נגד {self.against}"), self.header_font, lambda_f=lambda w, h: (1011-w, 60))
+        self.load_question_text(self.shape(f"{self.qc}/{GL}"), self.header_font, pos=(69, 60))
+        self.load_question_text(self.shape(f"שאלה {self.qc}"), self.large_header_font, lambda_f=lambda w, h: (915-w, 120))
+        self.load_question_text(self.shape(self.qrsp.fields[0]), self.question_font, center=(SCREEN_SIZE[0] / 2, 340))
 
         for i in range(1, 5):
-            self.load_question_text(hebrew_proof(self.qrsp.fields[i]), self.answers_font, center=ANS_CENT[i - 1], bgc=(61, 65, 118))
+            self.load_question_text(self.shape(self.qrsp.fields[i]), self.answers_font, center=ANS_CENT[i - 1], bgc=(61, 65, 118))
 
         self.state = "question"
 
@@ -462,11 +731,12 @@ class Gui:
 
             self.qt -= 1
             if self.qt <= 3:
-                sc = pygame.image.load("assets/pictures/question_lowtime.png")  # Timer turns red at the last 3 sec
+                sc = self.pictures["question_lowtime"]  # Timer turns red at the last 3 sec
             else:
-                sc = pygame.image.load("assets/pictures/question.png")
+                sc = self.pictures["question"]
 
-            self.screen.blit(sc, (0, 0))
+            timer = pygame.Rect(TIMER_AREA)  # Only the timer is drawn again, so only it is pushed to the display
+            self.blit(sc, timer, timer)
             self.load_question_text(str(self.qt), self.timer_font, center=(971, 183))
 
         sleep(1)
@@ -490,7 +760,7 @@ class Gui:
         :type lambda_f:
         :type bgc: (int, int, int)
         """
-        text = font.render(text, True, (255, 255, 255))
+        text = self.fonts.render(text, font)
 
         if center:
             pos = text.get_rect(center=center)
@@ -506,34 +776,46 @@ class Gui:
             elif pos:
                 rect = pygame.Rect(pos[0], pos[1], 433, 78)
 
-            pygame.draw.rect(self.screen, bgc, rect, 0)
+            self.mark(pygame.draw.rect(self.screen, bgc, rect, 0))
 
-        self.screen.blit(text, pos)
+        self.blit(text, pos)
 
     def ask_for_match(self) -> None:
         """
         Establish connection with server and ask for match.
+        The connection of the previous game is reused, unless the nickname or server has changed since.
         """
 
         print(f"Loading match screen for topic {self.topic}...")
         self.state = "match"
         self.load_video("assets/videos/match.mp4")
-        print("Loaded. Connecting to server...")
 
-        try:
-            self.sock = establish_connection(self.name, ip=self.ip)
-        except Error.Client.ConnectionFailed:
-            self.raise_error()
-            return
-        except Error.Client.UnexpectedResponse:
-            self.raise_error()
-            return
+        if self.conn and (self.conn.name != self.name or self.conn.ip != self.ip or not self.conn.alive()):
+            self.close_connection()
+
+        if self.conn is None:
+            print("Loaded. Connecting to server...")
+
+            try:
+                self.conn = TriviaClient(self.name, ip=self.ip, framed=FRAMED, bank=self.bank, cache=self.cache)
+                self.conn.connect()
+            except Error.Client.ConnectionFailed:
+                self.conn = None
+                self.raise_error()
+                return
+            except Error.Client.UnexpectedResponse:
+                self.conn = None
+                self.raise_error()
+                return
+
+            if self.conn.bank is not self.bank:  # Synced with a changed server bank
+                self.bank = self.conn.bank
+                self.shaped = preshape(self.bank)
 
-        msg = build_message("S", self.topic)
         print("Connection established. Requesting match...")
 
         # Start another thread to handle connection and update counter
-        self.conn_t = MatchThread(self, self.sock, msg)
+        self.conn_t = MatchThread(self, self.conn, self.topic)
         self.conn_t.start()
 
     def load_next_question(self, rsp) -> None:
@@ -548,24 +830,15 @@ class Gui:
 
         elif rsp.code == "R":
             self.qc = 0  # Reset question count
-            self.sock.close()  # Close server connection
 
-            # Load results screen
+            # Load results screen - winner, tie or loser
             print("Loading results screen...")
 
-            if rsp.fields[0] == self.name:
-                bg = pygame.image.load("assets/pictures/winner.png")
-                self.state = "results-winner"
-
-            elif rsp.fields[0] == "B":
-                bg = pygame.image.load("assets/pictures/tie.png")
-                self.state = "results-tie"
-
-            else:
-                bg = pygame.image.load("assets/pictures/loser.png")
-                self.state = "results-loser"
+            outcome = self.conn.outcome(rsp)
+            bg = self.pictures[outcome]
+            self.state = f"results-{outcome}"
 
-            self.screen.blit(bg, (0, 0))
+            self.blit(bg, (0, 0))
             print("Loaded. Waiting for user...")
 
         else:
@@ -578,24 +851,14 @@ class Gui:
         Handle video playing in the mainloop - one frame at a time.
         """
 
-        if self.fc == self.fm:
-            self.video = cv2.VideoCapture(self.playvid)
-            self.fc = 0
-
-        self.clock.tick(self.fps)
-
-        success, video_image = self.video.read()
-        video_surf = None
+        self.clock.tick(self.video.fps)
 
-        if success:
-            video_surf = pygame.image.frombuffer(
-                video_image.tobytes(), video_image.shape[1::-1], "BGR")
-
-        self.screen.blit(video_surf, (0, 0))
-        self.fc += 1
+        video_surf = self.video.next_frame()
+        if video_surf:
+            self.blit(video_surf, (0, 0))
 
         for p in self.play_on_vid.items():
-            self.screen.blit(p[1][0], p[1][1])
+            self.blit(p[1][0], p[1][1])
 
     def load_welcome_screen(self) -> None:
         """
@@ -606,8 +869,8 @@ class Gui:
 
         #   Welcome screen:
         print("Loading welcome screen...")
-        welcome_bg = pygame.image.load("assets/pictures/welcome.png")
-        self.screen.blit(welcome_bg, (0, 0))
+        welcome_bg = self.pictures["welcome"]
+        self.blit(welcome_bg, (0, 0))
 
         print("Loaded. Waiting for user...")
 
@@ -617,8 +880,8 @@ class Gui:
         """
 
         print("Loading topics screen...")
-        sc = pygame.image.load("assets/pictures/topics.png")
-        self.screen.blit(sc, (0, 0))
+        sc = self.pictures["topics"]
+        self.blit(sc, (0, 0))
         self.state = "topics"
         print("Loaded. Waiting for user...")
 
@@ -628,8 +891,8 @@ class Gui:
         """
 
         print("Loading credits screen...")
-        sc = pygame.image.load("assets/pictures/credits.png")
-        self.screen.blit(sc, (0, 0))
+        sc = self.pictures["credits"]
+        self.blit(sc, (0, 0))
         self.state = "credits"
         print("Loaded. Waiting for user...")
 
@@ -639,8 +902,8 @@ class Gui:
         """
 
         print("Loading sharon screen...")
-        sc = pygame.image.load("assets/pictures/sharon.png")
-        self.screen.blit(sc, (0, 0))
+        sc = self.pictures["sharon"]
+        self.blit(sc, (0, 0))
         self.state = "sharon"
         print("Loaded. Waiting for user...")
 
@@ -650,8 +913,8 @@ class Gui:
         """
 
         print("Loading settings screen...")
-        sc = pygame.image.load("assets/pictures/settings.png")
-        self.screen.blit(sc, (0, 0))
+        sc = self.pictures["settings"]
+        self.blit(sc, (0, 0))
         self.state = "settings"
 
         # Load textbox
@@ -683,10 +946,8 @@ class Gui:
             self.namemgr.blit()
 
         else:
-            font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 32)
-            text = font.render(hebrew_proof("הזנת תו שגוי"), True,
-                               (228, 64, 50))
-            self.screen.blit(text, (900, 680))
+            text = self.fonts.render(self.shape("הזנת תו שגוי"), self.fonts.get("Regular", 32), (228, 64, 50))
+            self.blit(text, (900, 680))
 
     def handle_addr_typing(self, event):
         """
@@ -702,10 +963,8 @@ class Gui:
             self.ipmgr.blit()
 
         else:
-            font = pygame.font.Font("assets/fonts/Ploni/Regular.ttf", 40)
-            text = font.render(hebrew_proof("הזנת תו שגוי"), True,
-                               (228, 64, 50))
-            self.screen.blit(text, (900, 680))
+            text = self.fonts.render(self.shape("הזנת תו שגוי"), self.fonts.get("Regular", 40), (228, 64, 50))
+            self.blit(text, (900, 680))
 
     def handle_mouse_click_on_welcome(self):
         """
@@ -829,8 +1088,10 @@ class Gui:
         x, y = pygame.mouse.get_pos()
 
         if 478 < x < 602 and 633 < y < 677:  # If user clicked on cancel button
-            # Stop looking for a match and alert the server
+            # Stop looking for a match and alert the server - the match thread cancels and closes its connection,
+            # so the next search opens a new one instead of sharing it with the stopping thread
             self.conn_t.stop()
+            self.conn = None
 
             # Load topics screen
             self.stop_video()
@@ -860,34 +1121,42 @@ class Gui:
         :type ans: int
         """
 
-        send_message(self.sock, SID, build_message("A", ans))  # Send answer to server
+        self.conn.send("A", ans)  # Send answer to server
 
         if ans != 0:
-            self.load_question_text(hebrew_proof(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
+            self.load_question_text(self.shape(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
                                     bgc=(134, 170, 223))  # Highlight chosen answer
 
         # Wait for the next question / game results
-        rsp = recv_message(self.sock, SID, timeout=TIMEOUT + ANS)
+        rsp = self.conn.recv(timeout=TIMEOUT + ANS)
 
         if ans != 0:
             results_ptr = 5 if rsp.code == "Q" else 1
             if int(rsp.fields[results_ptr]) == ans:
-                self.load_question_text(hebrew_proof(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
+                self.load_question_text(self.shape(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
                                         bgc=(0, 128, 55))
             else:
-                self.load_question_text(hebrew_proof(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
+                self.load_question_text(self.shape(self.qrsp.fields[ans]), self.answers_font, center=ANS_CENT[ans - 1],
                                         bgc=(228, 64, 50))
 
         sleep(0.3)
         self.load_next_question(rsp)  # Load next question / game results
 
     def run(self) -> None:
-        """ Mainloop function """
+        """
+        Mainloop function - pushes only the changed screen areas to the display.
+        While a video plays, the loop runs at the video frame rate. Otherwise, it sleeps until an event arrives.
+        """
 
         while True:
+            self.update_display()
+
             # Handle video playing:
             if self.playvid:
                 self.playvid_mainloop()
+                events = pygame.event.get()
+            else:
+                events = [pygame.event.wait(IDLE_TICK)] + pygame.event.get()
 
             # Handle thread flags:
             if self.state == "question_flag":
@@ -895,7 +1164,7 @@ class Gui:
                 self.state = "question"
 
             # Handle events:
-            for event in pygame.event.get():
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.close_client()
 
@@ -937,8 +1206,6 @@ class Gui:
                     elif self.state == "settings-addr-tb":
                         self.handle_addr_typing(event)
 
-            pygame.display.flip()  # Update screen
-
 
 def main():
     gui = Gui()
@@ -0,0 +1,19 @@
+# Trivia - TCP Quiz Game POC [2.0.0]
+# By Martin Alebachew
+# COMPILE_BANK.PY
+# #####
+
+from protocol import *
+
+
+def main():
+    # Usage: compile_bank.py [questions directory] [compiled bank path]
+    src = sys.argv[1] if len(sys.argv) > 1 else "questions"
+    path = sys.argv[2] if len(sys.argv) > 2 else BANK_PATH
+
+    count = compile_bank(path, src)
+    print(f"Compiled {count} questions into {path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,86 @@
 # PROTOCOL.PY
 # #####
 
+import array
+import asyncio
+import atexit
+import bisect
+import collections
+import functools
+import hashlib
+import itertools
+import mmap
+import os
+import random
+import selectors
 import socket
+import struct
+import sys
 import threading
-from random import randint
+import zlib
+from typing import Union
+from time import monotonic, perf_counter, sleep
 
 # Protocol-wide settings
 PORT = 15999  # Protocol port
 TIMEOUT = 3  # Default recv timeout (seconds)
 BUFF = 1024  # recv buffer size
+FRAME_HEADER = struct.Struct("!I")  # Length prefix of a framed message (big-endian, so a frame always starts with 0x00)
+MAX_FRAME = 65536  # Largest accepted framed message (bytes)
+RECV_BUFF = 4096  # Initial receive buffer of a framed connection, grown for larger frames (bytes)
+OUT_LIMIT = 65536  # Unsent bytes a connection may queue before writing flushes them, waiting for the peer to read
+OUT_IOV = 1024  # Largest number of chunks written by a single sendmsg call (IOV_MAX)
+SENDMSG = hasattr(socket.socket, "sendmsg")  # Whether chunks can be written without joining them (not on Windows)
+SEND_TIMEOUT = TIMEOUT  # Time a peer has to read queued output before the connection is considered failed (seconds)
 
 DW = 5  # Time to wait before asking for rematch
 ANS = 10  # Time to answer question - before timeout
 GL = 8  # Game length
-
-MSG_CODES = ["I", "W", "S", "C", "N", "Q", "A", "R", "E"]  # Existing messages in protocol
+QD = 0.2  # Delay between collecting the answers of a question and sending the next one (seconds)
+IDLE = 60  # Time a connection may stay idle between games before it is closed (seconds)
+
+DEBUG = False  # Validate every built message by breaking it down again (slow - debug mode only)
+Q_CACHE = 65536  # Number of pre-encoded questions to keep - see QuestionFrames
+
+# Logging settings - see Logger
+LOG_LEVELS = ["trace", "info", "warning", "error"]  # Log levels by value, "trace" logs every sent and received message
+TRACE, INFO, WARNING, ERROR = range(len(LOG_LEVELS))
+LOG_RING = 4096  # Number of recent records kept in memory
+LOG_BUFFER = 65536  # Number of records waiting for the writer before the oldest ones are dropped
+LOG_FLUSH = 0.1  # Writer flush interval (seconds)
+
+# Metrics settings - see Metrics
+METRICS_PORT = PORT + 1  # Local metrics endpoint port
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)  # Histogram buckets of network waits (seconds)
+CODEC_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3)  # Histogram buckets of encode/decode times (seconds)
+
+MSG_CODES = ["I", "W", "S", "C", "N", "Q", "A", "R", "E", "B"]  # Existing messages in protocol
+CODE_BYTES = {ord(code): code for code in MSG_CODES}  # Message codes by their encoded byte
+SEPARATOR = ord("~")  # Encoded field separator
+V1 = 1  # Text wire format - "~"-separated fields, the only format of unframed connections
+V2 = 2  # Compact wire format, negotiated in the handshake - see build_compact
+V2_CODES = {code: i for i, code in enumerate(MSG_CODES, 1)}  # Compact message codes, below any text code byte
+V2_FIELDS = {  # Leading numeric fields packed by compact messages, and their count
+    "N": (struct.Struct("!H"), 1),  # time to wait
+    "Q": (struct.Struct("!IB"), 2),  # question index, permutation id
+    "A": (struct.Struct("!B"), 1),  # answer
+    "B": (struct.Struct("!B"), 1),  # bank section index in SECTIONS
+}
+V2_BLOBS = {"B"}  # Compact messages whose packed fields are followed by raw bytes instead of text fields
+V2_TEXTS = {"I", "S", "Q", "R", "E"}  # Compact messages that always end with text fields, even a single empty one
 TOPICS = ["lit", "art", "sci", "mix", "mus", "cin"]  # Trivia topics by pos (DO NOT ALTER)
+SECTIONS = tuple(topic for topic in TOPICS if topic != "mix")  # Topics stored in a bank, in order - "mix" spans all
+PERMUTATIONS = tuple(itertools.permutations(range(4)))  # Answer orders by permutation id - see QuestionBank
+CORRECT = tuple(p.index(0) + 1 for p in PERMUTATIONS)  # Correct answer number (1-4) by permutation id
+
+# Compiled question bank format - see compile_bank
+BANK_PATH = "questions/questions.bank"  # Default compiled question bank, used instead of the text files if it exists
+BANK_MAGIC = b"TRVB"
+BANK_VERSION = 2
+BANK_HEADER = struct.Struct("<4sHHQQQ")  # magic, version, topic count, question count, index offset, topic table offset
+BANK_TOPIC = struct.Struct("<8sQQ32s")  # topic name, first question index, end question index, section digest (sha256)
+BANK_OFFSETS = struct.Struct("<QQ")  # start and end offset of a string in the bank
+BANK_CHUNK = MAX_FRAME - 16  # Largest compressed bank section chunk sent in a single sync message (bytes)
 
 
 # Protocol-wide classes
@@ -32,6 +97,12 @@ class Error:
         class MessageValidationError(Exception):
             pass
 
+        class FrameTooLarge(Exception):
+            pass
+
+        class InvalidQuestionBank(Exception):
+            pass
+
     class Client:
         class ConnectionFailed(Exception):
             pass
@@ -39,6 +110,9 @@ class Error:
         class UnexpectedResponse(Exception):
             pass
 
+        class InvalidArgs(Exception):
+            pass
+
     class Server:
         class InvalidArgs(Exception):
             pass
@@ -47,6 +121,183 @@ class Error:
             pass
 
 
+class Counter:
+    def __init__(self, name, info):
+        """
+        Monotonically increasing metric.
+
+        :param name: metric name
+        :param info: metric description
+        :type name: str
+        :type info: str
+        """
+
+        self.name = name
+        self.info = info
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def samples(self) -> list[(str, float)]:
+        return [(self.name, self.value)]
+
+
+class Gauge(Counter):
+    def __init__(self, name, info, fn=None, label=None):
+        """
+        Metric that goes up and down.
+        A gauge with a function is only computed when the metrics are read, so it costs nothing to record.
+
+        :param name: metric name
+        :param info: metric description
+        :param fn: function returning the value, or a dict of values by label value if a label is given
+        :param label: label name of the values returned by fn
+        :type name: str
+        :type info: str
+        :type fn: function
+        :type label: str
+        """
+
+        super().__init__(name, info)
+        self.fn = fn
+        self.label = label
+
+    def dec(self, amount=1) -> None:
+        with self.lock:
+            self.value -= amount
+
+    def track(self) -> "GaugeTracker":
+        """
+        Returns a context manager that increments the gauge for as long as its block runs.
+        """
+
+        return GaugeTracker(self)
+
+    def samples(self) -> list[(str, float)]:
+        if self.fn is None:
+            return [(self.name, self.value)]
+        if self.label is None:
+            return [(self.name, self.fn())]
+        return [(f'{self.name}{{{self.label}="{k}"}}', v) for k, v in self.fn().items()]
+
+
+class GaugeTracker:
+    def __init__(self, gauge):
+        self.gauge = gauge
+
+    def __enter__(self):
+        self.gauge.inc()
+
+    def __exit__(self, *exc):
+        self.gauge.dec()
+
+
+class Histogram:
+    def __init__(self, name, info, buckets=LATENCY_BUCKETS):
+        """
+        Distribution of observed values over fixed buckets.
+        Observations are counted in their own bucket only, and summed up when the metrics are read.
+
+        :param name: metric name
+        :param info: metric description
+        :param buckets: sorted upper bounds of the buckets
+        :type name: str
+        :type info: str
+        :type buckets: tuple[float]
+        """
+
+        self.name = name
+        self.info = info
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Observations by bucket, the last one is +Inf
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self) -> list[(str, float)]:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+
+        samples = []
+        for bound, count in zip(self.buckets + ("+Inf",), itertools.accumulate(counts)):
+            samples.append((f'{self.name}_bucket{{le="{bound}"}}', count))
+        samples.append((f"{self.name}_sum", total))
+        samples.append((f"{self.name}_count", sum(counts)))
+        return samples
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Registry of the process metrics, read in Prometheus text format.
+        Encode and decode times are only measured once enabled, so clients don't pay for them.
+        """
+
+        self.enabled = False
+        self.metrics = []
+
+    def counter(self, name, info) -> Counter:
+        return self._register(Counter(name, info))
+
+    def gauge(self, name, info, fn=None, label=None) -> Gauge:
+        return self._register(Gauge(name, info, fn, label))
+
+    def histogram(self, name, info, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, info, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """
+        Returns all metrics in Prometheus text format.
+        """
+
+        lines = []
+        for metric in self.metrics:
+            kind = type(metric).__name__.lower()
+            lines.append(f"# HELP {metric.name} {metric.info}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(f"{name} {value}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram):
+    """
+    Decorator that observes the run time of a function in a histogram, while metrics are enabled.
+
+    :param histogram: run time histogram
+    :type histogram: Histogram
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+
+            start = perf_counter()
+            result = func(*args, **kwargs)
+            histogram.observe(perf_counter() - start)
+            return result
+        return wrapper
+    return decorator
+
+
+metrics = Metrics()  # Process-wide metrics registry
+ENCODE_TIME = metrics.histogram("trivia_encode_seconds", "Time to encode a message.", CODEC_BUCKETS)
+DECODE_TIME = metrics.histogram("trivia_decode_seconds", "Time to decode a message.", CODEC_BUCKETS)
+
+
 class Question:
     def __init__(self, q, a1, a2, a3, a4, c):
         """
@@ -73,15 +324,185 @@ class Question:
         self.a4 = a4
         self.c = c
 
-    def randomize(self):
+
+class QuestionBank:
+    def __init__(self, texts, topics, sections=None):
+        """
+        Immutable, array-backed bank of all questions.
+        Questions of a topic are stored contiguously, so every topic is a range of question indices,
+        and "mix" is simply the range of the whole bank.
+        Games never copy or modify the bank - they draw question indices and an answer permutation for each.
+
+        :param texts: flat immutable sequence of question strings - question text followed by its 4 answers,
+        correct first
+        :param topics: range of question indices by topic
+        :param sections: known section digests by topic, such as the ones stored in a compiled bank - see sections
+        :type texts: Union[tuple[str], MappedTexts]
+        :type topics: dict[str, range]
+        :type sections: dict[str, str]
+        """
+
+        self._texts = texts
+        self._topics = dict(topics)
+        self._sections = sections  # Section digests by topic, see sections
+
+    def __len__(self):
+        return len(self._texts) // 5
+
+    def digest(self) -> str:
+        """
+        Returns a hex digest of the bank contents, derived from the digests of its sections in order.
+        Banks with the same digest hold the same questions at the same indices,
+        so peers holding one can exchange question indices instead of texts.
+        """
+
+        h = hashlib.sha256()
+        for topic, digest in self.sections().items():
+            h.update(f"{topic}:{digest}\n".encode())
+        return h.hexdigest()
+
+    def sections(self) -> dict[str, str]:
+        """
+        Returns the hex digest of the texts of every bank section (see SECTIONS), by topic.
+        A section is addressed by its contents, so a peer only needs the sections whose digests it doesn't hold.
+        A compiled bank stores them, otherwise they are computed once, on first use.
+        """
+
+        if self._sections is None:
+            self._sections = {topic: section_digest(self.texts(topic)).hexdigest() for topic in SECTIONS}
+        return self._sections
+
+    def texts(self, topic) -> list[str]:
+        """
+        Returns the texts of the questions in a given topic, in order -
+        every question text followed by its 4 answers, correct first.
+
+        :param topic: topic name, as defined in the protocol
+        :type topic: str
+        :raises Error.Protocol.UnknownTopic: if the topic is not in the bank
+        """
+
+        indices = self.topic(topic)
+        return [self._texts[i] for i in range(indices.start * 5, indices.stop * 5)]
+
+    def topic(self, topic) -> range:
+        """
+        Returns the range of question indices in a given topic.
+
+        :param topic: topic name, as defined in the protocol
+        :type topic: str
+        :raises Error.Protocol.UnknownTopic: if the topic is not in the bank
+        """
+
+        if topic not in self._topics:
+            raise Error.Protocol.UnknownTopic
+        return self._topics[topic]
+
+    def draw(self, topic, length) -> list[(int, int)]:
+        """
+        Returns a random list of (question index, permutation id) pairs in a given topic, in O(length).
+
+        :param topic: topic name, as defined in the protocol
+        :param length: number of questions to draw
+        :type topic: str
+        :type length: int
+        :raises Error.Protocol.UnknownTopic: if the topic is not in the bank
+        :raises Error.Server.NotEnoughQuestions: if the requested length is greater than the number
+        of questions available in that topic
+        """
+
+        indices = self.topic(topic)
+        if len(indices) < length:
+            raise Error.Server.NotEnoughQuestions
+
+        # Sampling a range picks indices without materializing the topic
+        return [(i, random.randrange(len(PERMUTATIONS))) for i in random.sample(indices, length)]
+
+    def question(self, index, perm=0) -> Question:
+        """
+        Returns a question with its answers ordered by a given permutation.
+
+        :param index: question index
+        :param perm: permutation id - index in PERMUTATIONS, 0 keeps the correct answer first
+        :type index: int
+        :type perm: int
+        """
+
+        base = index * 5
+        order = PERMUTATIONS[perm]
+        answers = [self._texts[base + 1 + j] for j in order]
+        return Question(self._texts[base], *answers, CORRECT[perm])
+
+
+class QuestionFrames:
+    def __init__(self, bank, size=Q_CACHE):
+        """
+        Cache of pre-encoded question messages by question index and permutation id,
+        so the bytes of a question are only built the first time it is asked with a given answer order.
+        Only the last field of a question message changes between sends, so it is appended to the cached bytes.
+
+        :param bank: question bank
+        :param size: maximum number of cached questions
+        :type bank: QuestionBank
+        :type size: int
+        """
+
+        self.bank = bank
+        self._prefix = functools.lru_cache(maxsize=size)(self._encode)
+
+    def _encode(self, index, perm) -> bytes:
+        q = self.bank.question(index, perm)
+        return build_message("Q", q.q, q.a1, q.a2, q.a3, q.a4, "").encode()  # Empty last field leaves a trailing "~"
+
+    @timed(ENCODE_TIME)
+    def message(self, index, perm, last, version=V1) -> bytes:
+        """
+        Returns an encoded question message.
+        In the compact wire format, the question is sent by its index and permutation id instead of its texts.
+
+        :param index: question index
+        :param perm: permutation id
+        :param last: last field - rival nickname or answer of the previous question
+        :param version: wire format version of the receiving connection
+        :type index: int
+        :type perm: int
+        :type last: Union[str, int]
+        :type version: int
+        """
+
+        if version == V2:
+            return build_compact("Q", index, perm, last)
+        return self._prefix(index, perm) + str(last).encode()
+
+
+class MappedTexts:
+    def __init__(self, buffer, index_offset, count):
         """
-        Randomize order of answers.
+        Read-only sequence of the strings in a compiled question bank.
+        Strings are decoded from the mapped file only when accessed,
+        so neither loading time nor resident memory depend on the bank size.
+
+        :param buffer: mapped bank file
+        :param index_offset: position of the string offsets index in the file
+        :param count: number of strings in the bank
+        :type buffer: mmap.mmap
+        :type index_offset: int
+        :type count: int
         """
-        new_c = randint(1, 4)
 
-        # Using exec to swap old and new position of correct answer
-        exec(f"self.a{new_c}, self.a{self.c} = self.a{self.c}, self.a{new_c}")
-        self.c = new_c
+        self._view = memoryview(buffer)
+        self._index_offset = index_offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError
+
+        start, end = BANK_OFFSETS.unpack_from(self._view, self._index_offset + i * 8)
+        return str(self._view[start:end], "utf-8")
 
 
 class Message:
@@ -90,9 +511,9 @@ class Message:
         Represents a single message of any code, according to protocol.
 
         :param code: message code
-        :param fields: additional fields
+        :param fields: additional fields - numeric fields of compact messages are ints
         :type code: str
-        :type fields: list[str]
+        :type fields: list[Union[str, int]]
         """
 
         self.code = code
@@ -111,6 +532,200 @@ class Message:
 
         return True
 
+    def __str__(self):
+        return "~".join([self.code] + [f"<{len(field)} bytes>" if isinstance(field, bytes) else str(field)
+                                       for field in self.fields])
+
+
+class FrameDecoder:
+    def __init__(self, size=RECV_BUFF):
+        """
+        Incremental decoder of length-prefixed frames, one per connection.
+        Sockets are read straight into a preallocated buffer, reused between reads and grown only for larger frames,
+        and every complete frame of a read is parsed in place and queued as a message - see parse_message.
+
+        :param size: initial buffer size
+        :type size: int
+        """
+
+        self.buffer = bytearray(size)  # Receive buffer - undecoded bytes are kept between start and end
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.messages = collections.deque()  # Decoded messages that were not returned yet
+
+    def recv_into(self, sock) -> int:
+        """
+        Reads from a socket straight into the buffer and decodes all complete frames.
+        Returns the number of bytes read - 0 once the connection is closed.
+
+        :param sock: connected socket
+        :type sock: socket.socket
+        :raises FrameTooLarge: if a frame header announces more than MAX_FRAME bytes
+        """
+
+        self._reserve(BUFF)
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        self.decode()
+        return count
+
+    def feed(self, data) -> int:
+        """
+        Appends received bytes to the buffer and decodes all complete frames.
+        Returns the number of newly decoded messages.
+
+        :param data: received bytes
+        :type data: bytes
+        :raises FrameTooLarge: if a frame header announces more than MAX_FRAME bytes
+        """
+
+        self._reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self.decode()
+
+    def decode(self) -> int:
+        """
+        Decodes all complete frames in the buffer and returns the number of newly decoded messages.
+
+        :raises FrameTooLarge: if a frame header announces more than MAX_FRAME bytes
+        """
+
+        buffer = self.buffer
+        pos = self.start
+        count = 0
+
+        while self.end - pos >= FRAME_HEADER.size:
+            length, = FRAME_HEADER.unpack_from(buffer, pos)
+            if length > MAX_FRAME:
+                raise Error.Protocol.FrameTooLarge
+
+            end = pos + FRAME_HEADER.size + length
+            if end > self.end:  # Frame is not complete yet
+                break
+
+            msg = parse_message(buffer, pos + FRAME_HEADER.size, end)
+            if msg:
+                self.messages.append(msg)
+                count += 1
+            pos = end
+
+        if pos == self.end:  # Everything decoded - the next read starts at the beginning of the buffer
+            self.start = self.end = 0
+        else:
+            self.start = pos
+        return count
+
+    def _reserve(self, size) -> None:
+        """
+        Makes room for a given number of bytes at the end of the buffer -
+        moves a partial frame to the beginning of the buffer, and grows the buffer if it's still too small.
+        """
+
+        if len(self.buffer) - self.end >= size:
+            return
+
+        if self.start:
+            kept = self.end - self.start
+            self.buffer[:kept] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, kept
+
+        if len(self.buffer) - self.end < size:
+            self.view.release()  # A buffer can't be resized while viewed
+            self.buffer.extend(bytes(max(len(self.buffer), size)))
+            self.view = memoryview(self.buffer)
+
+
+class OutputBuffer:
+    def __init__(self, sock, limit=OUT_LIMIT):
+        """
+        Outbound queue of a connection.
+        Messages are queued as chunks (frame header and message bytes, without joining them) until flushed,
+        and everything queued is written by a single sendmsg (writev) call, so a batch of frames is coalesced.
+        A partial write leaves the rest of its chunks queued, so messages are never truncated.
+        Once more than limit bytes are queued, writing flushes them, waiting for the peer to read (backpressure).
+        Used by a single thread at a time, just like its socket.
+
+        :param sock: connected socket
+        :param limit: unsent bytes kept before writing waits
+        :type sock: socket.socket
+        :type limit: int
+        """
+
+        self.sock = sock
+        self.limit = limit
+        self.chunks = collections.deque()  # Unsent chunks - the first one may be a view of a partially sent chunk
+        self.pending = 0  # Unsent bytes
+
+        if sock.family in (socket.AF_INET, socket.AF_INET6):  # Frames are coalesced here - don't delay them again
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, *chunks) -> None:
+        """
+        Queues chunks without sending them - they are sent together by the next flush.
+        Flushes right away only if more than limit bytes are queued.
+
+        :param chunks: bytes to send, in order
+        :type chunks: bytes
+        :raises TimeoutError: if the peer didn't read in time
+        :raises OSError: if the connection has failed
+        """
+
+        for chunk in chunks:
+            if chunk:
+                self.chunks.append(chunk)
+                self.pending += len(chunk)
+
+        if self.pending > self.limit:
+            self.flush()
+
+    def send(self) -> bool:
+        """
+        Sends queued chunks without waiting, and returns True if nothing is left unsent.
+
+        :raises OSError: if the connection has failed
+        """
+
+        self.sock.settimeout(0)
+
+        while self.chunks:
+            chunks = itertools.islice(self.chunks, 0, OUT_IOV)
+            try:
+                sent = self.sock.sendmsg(chunks) if SENDMSG else self.sock.send(b"".join(chunks))
+            except (BlockingIOError, InterruptedError):
+                return False
+
+            self.pending -= sent
+            while sent:  # Drop sent chunks, and keep the unsent end of a partially sent one
+                if len(self.chunks[0]) <= sent:
+                    sent -= len(self.chunks.popleft())
+                else:
+                    self.chunks[0] = memoryview(self.chunks[0])[sent:]
+                    sent = 0
+
+        return True
+
+    def flush(self, timeout=SEND_TIMEOUT) -> None:
+        """
+        Sends every queued chunk, waiting for the peer to read up to a given time.
+
+        :param timeout: time to wait for the peer (seconds)
+        :type timeout: Union[float, int]
+        :raises TimeoutError: if the peer didn't read in time
+        :raises OSError: if the connection has failed
+        """
+
+        if self.send():
+            return
+
+        deadline = monotonic() + timeout
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.sock, selectors.EVENT_WRITE)
+            while not self.send():
+                if not sel.select(max(deadline - monotonic(), 0)):
+                    raise TimeoutError
+
 
 class StoppableThread(threading.Thread):
     def __init__(self, target):
@@ -142,16 +757,137 @@ class StoppableThread(threading.Thread):
         return self._stop_event.is_set()
 
 
+class Logger:
+    def __init__(self, level=INFO, sample=1):
+        """
+        Leveled console logger. Records are queued in memory and written by a background thread,
+        so logging threads and tasks never block on the console.
+        When the writer falls behind, the oldest waiting records are dropped and counted.
+
+        :param level: lowest logged level
+        :param sample: log trace and info records of 1 in every sample connections, warnings and errors are always logged
+        :type level: int
+        :type sample: int
+        """
+
+        self.level = level
+        self.sample = sample
+        self.pending = collections.deque(maxlen=LOG_BUFFER)  # Records waiting for the writer
+        self.recent = collections.deque(maxlen=LOG_RING)  # Ring buffer of the latest records
+        self.dropped = 0  # Records dropped since the last flush
+        self.lock = threading.Lock()  # Serializes writer start and flushes
+        self.writer = None  # Background writer thread, started on the first record
+
+        atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):  # Not available on Windows, which never forks
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def enabled(self, conn, level) -> bool:
+        """
+        Checks whether a record of a given connection and level should be logged,
+        so callers can skip formatting it otherwise.
+
+        :param conn: connection info string
+        :param level: record level
+        :type conn: str
+        :type level: int
+        """
+
+        if level < self.level:
+            return False
+        return level >= WARNING or self.sample == 1 or hash(conn) % self.sample == 0
+
+    def traces(self, conn) -> bool:
+        return self.enabled(conn, TRACE)
+
+    def write(self, conn, info) -> None:
+        """
+        Queues a record for the writer, without checking its level.
+
+        :param conn: connection info string
+        :param info: desired printed info
+        """
+
+        record = f"({conn}) {info}"
+        if len(self.pending) == LOG_BUFFER:
+            self.dropped += 1
+
+        self.pending.append(record)
+        self.recent.append(record)
+
+        if self.writer is None:
+            self._start()
+
+    def tail(self, n=LOG_RING) -> list[str]:
+        """
+        Returns up to n latest records from the ring buffer.
+
+        :param n: number of records
+        :type n: int
+        """
+
+        return list(self.recent)[-n:]
+
+    def flush(self) -> None:
+        """
+        Writes all waiting records to the console.
+        """
+
+        with self.lock:
+            records = []
+            try:
+                while True:
+                    records.append(self.pending.popleft())
+            except IndexError:
+                pass
+
+            if self.dropped:
+                records.append(f"(log) Dropped {self.dropped} records.")
+                self.dropped = 0
+
+            if records:
+                sys.stdout.write("\n".join(records) + "\n")
+                sys.stdout.flush()
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._run, daemon=True)
+                self.writer.start()
+
+    def _run(self) -> None:
+        while True:
+            sleep(LOG_FLUSH)
+            self.flush()
+
+    def _after_fork(self) -> None:
+        """
+        Resets the logger in a forked process - threads don't survive a fork,
+        and records waiting in the parent are written by the parent.
+        """
+
+        self.lock = threading.Lock()
+        self.writer = None
+        self.pending.clear()
+        self.dropped = 0
+
+
+logger = Logger()  # Process-wide logger - see log
+
+
 # Protocol-wide functions
-def log(conn, info) -> None:
+def log(conn, info, level=INFO) -> None:
     """
-    Logs given info to the console.
+    Logs given info to the console through the background writer.
 
     :param conn: connection info string
     :param info: desired printed info
+    :param level: record level
+    :type level: int
     """
 
-    print(f"({conn}) {info}")
+    if logger.enabled(conn, level):
+        logger.write(conn, info)
 
 
 def build_message(code, *fields) -> str:
@@ -169,16 +905,135 @@ def build_message(code, *fields) -> str:
     if code not in MSG_CODES: raise Error.Protocol.UnknownMessageCode  # Validate message type
 
     # Add encoded parameters
-    msg = code
-    for field in fields:
-        msg += "~" + str(field)
+    fields = [str(field) for field in fields]
+    msg = "~".join([code] + fields)
 
     # Return validated message
-    if break_message(msg) == Message(code, [str(field) for field in fields]):
+    if not DEBUG or break_message(msg) == Message(code, fields):
         return msg
     raise Error.Protocol.MessageValidationError
 
 
+def build_compact(code, *fields) -> bytes:
+    """
+    Builds a message in the compact wire format -
+    a single numeric code byte, the leading numeric fields of the message packed as integers (see V2_FIELDS),
+    and the rest of the fields "~"-separated, as in the text format. A message without text fields ends after
+    its packed fields, unless it is in V2_TEXTS - then an empty text section is a single empty field.
+    Messages in V2_BLOBS end with a single field of raw bytes instead.
+
+    :param code: message code
+    :param fields: additional fields
+    :type code: str
+    :type fields: Union[str, int, bytes]
+    :return: validated message bytes
+    :raises UnknownMessageCode: if message code is not defined in protocol
+    """
+
+    if code not in V2_CODES: raise Error.Protocol.UnknownMessageCode  # Validate message type
+
+    packer, count = V2_FIELDS.get(code, (None, 0))
+    msg = bytes((V2_CODES[code],))
+    if packer:
+        msg += packer.pack(*(int(field) for field in fields[:count]))
+    if code in V2_BLOBS:
+        msg += b"".join(fields[count:])
+    else:
+        msg += "~".join(str(field) for field in fields[count:]).encode()
+
+    # Return validated message
+    if not DEBUG or code in V2_BLOBS or parse_message.__wrapped__(msg, 0, len(msg)) == \
+            Message(code, [int(f) for f in fields[:count]] + [str(f) for f in fields[count:]]):
+        return msg
+    raise Error.Protocol.MessageValidationError
+
+
+@timed(ENCODE_TIME)
+def encode_message(code, *fields, version=V1) -> bytes:
+    """
+    Builds a message according to protocol, straight into bytes ready to be sent.
+    Messages are only validated in debug mode.
+
+    :param code: message code
+    :param fields: additional fields
+    :param version: wire format version of the receiving connection
+    :type code: str
+    :type fields: Union[str, int]
+    :type version: int
+    :raises UnknownMessageCode: if message code is not defined in protocol
+    """
+
+    if version == V2:
+        return build_compact(code, *fields)
+    return build_message(code, *fields).encode()
+
+
+@timed(DECODE_TIME)
+def parse_message(buffer, start, end) -> Union[Message, None]:
+    """
+    Breaks down an encoded message straight from a receive buffer, in either wire format -
+    compact messages are told apart by their code byte.
+    Fields are found in place, and only their own bytes are decoded,
+    so the message is never copied or decoded as a whole.
+
+    :param buffer: receive buffer
+    :param start: message start position in the buffer
+    :param end: message end position in the buffer
+    :type buffer: bytearray
+    :type start: int
+    :type end: int
+    :raises UnknownMessageCode: if message code is not defined in protocol
+    :raises MessageValidationError: if a compact message is shorter than its packed fields
+    """
+
+    if start == end:
+        return None
+
+    if 0 < buffer[start] <= len(MSG_CODES):  # Compact message
+        code = MSG_CODES[buffer[start] - 1]
+        packer, _ = V2_FIELDS.get(code, (None, 0))
+        pos = start + 1
+        fields = []
+
+        if packer:
+            if end - pos < packer.size:
+                raise Error.Protocol.MessageValidationError
+            fields.extend(packer.unpack_from(buffer, pos))
+            pos += packer.size
+
+        if code in V2_BLOBS:
+            fields.append(bytes(buffer[pos:end]))  # Copied out of the receive buffer, which is reused
+        elif pos < end or code in V2_TEXTS:
+            _split_fields(buffer, pos, end, fields)
+        return Message(code, fields)
+
+    code = CODE_BYTES.get(buffer[start])
+    if code is None or (end - start > 1 and buffer[start + 1] != SEPARATOR):
+        raise Error.Protocol.UnknownMessageCode
+
+    return Message(code, _split_fields(buffer, start + 2, end, []))
+
+
+def _split_fields(buffer, pos, end, fields) -> list[str]:
+    """
+    Decodes the "~"-separated fields between two positions of a receive buffer into a given list, and returns it.
+    """
+
+    while pos <= end:
+        sep = buffer.find(SEPARATOR, pos, end)
+        if sep < 0:
+            sep = end
+
+        if sep - pos == 1 and buffer[pos] < 0x80:  # Single ascii character - a cached string, nothing to decode
+            fields.append(chr(buffer[pos]))
+        else:
+            fields.append(buffer[pos:sep].decode())
+        pos = sep + 1
+
+    return fields
+
+
+@timed(DECODE_TIME)
 def break_message(msg) -> (str, list[str]):
     """
     Break down a message built according to protocol.
@@ -198,25 +1053,154 @@ def break_message(msg) -> (str, list[str]):
     return Message(code, fields)
 
 
-def send_message(sock, conn, msg) -> None:
+def raise_fd_limit() -> None:
+    """
+    Raises the soft limit of open file descriptors to the hard limit,
+    so a single process can hold as many connections as the system allows.
+    """
+
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def message_text(data) -> str:
+    """
+    Returns the readable form of encoded message bytes, for logs - compact messages are broken down first.
+
+    :param data: encoded message bytes
+    :type data: bytes
     """
-    Sends an unencoded message to a given socket and logs it.
+
+    if data and data[0] <= len(MSG_CODES):
+        return str(parse_message.__wrapped__(data, 0, len(data)))
+    return data.decode()
+
+
+def frame_messages(msgs, framed) -> list[bytes]:
+    """
+    Encodes messages and, in framed mode, prefixes each with its length - as separate chunks, without joining them.
+
+    :param msgs: message strings, or encoded message bytes, in order
+    :param framed: prefix every message with its length
+    :type msgs: list[Union[str, bytes]]
+    :type framed: bool
+    """
+
+    chunks = []
+    for msg in msgs:
+        data = msg.encode() if isinstance(msg, str) else msg
+        if framed:
+            chunks.append(FRAME_HEADER.pack(len(data)))
+        chunks.append(data)
+    return chunks
+
+
+def send_message(sock, conn, msg, framed=False, out=None) -> None:
+    """
+    Sends an unencoded message to a given socket and logs it - see send_messages.
 
     :param sock: connected target socket
     :param conn: connection info string
-    :param msg: unencoded message string
+    :param msg: message string, or encoded message bytes
+    :param framed: send as a length-prefixed frame
+    :param out: connection output buffer
     :type sock: socket.socket
     :type conn: str
-    :type msg: str
+    :type msg: Union[str, bytes]
+    :type framed: bool
+    :type out: OutputBuffer
+    :raises TimeoutError: if the peer didn't read in time
     """
 
-    sock.send(msg.encode())
-    log(conn, f">>>>> {msg}")
+    send_messages(sock, conn, (msg,), framed, out)
 
 
-def recv_message(sock, conn, timeout=TIMEOUT):
+def send_messages(sock, conn, msgs, framed=False, out=None) -> None:
+    """
+    Sends a batch of unencoded messages to a given socket and logs them.
+    The messages are queued first and sent together, coalesced into as few writes as the socket takes,
+    and are all sent before returning - through the connection output buffer if given.
+
+    :param sock: connected target socket
+    :param conn: connection info string
+    :param msgs: message strings, or encoded message bytes, in order
+    :param framed: send as length-prefixed frames
+    :param out: connection output buffer
+    :type sock: socket.socket
+    :type conn: str
+    :type msgs: Iterable[Union[str, bytes]]
+    :type framed: bool
+    :type out: OutputBuffer
+    :raises TimeoutError: if the peer didn't read in time
+    """
+
+    msgs = list(msgs)
+    chunks = frame_messages(msgs, framed)
+
+    if out is None:
+        sock.sendall(b"".join(chunks))
+    else:
+        out.write(*chunks)
+        out.flush()
+
+    if logger.traces(conn):
+        for msg in msgs:
+            logger.write(conn, f">>>>> {msg if isinstance(msg, str) else message_text(msg)}")
+
+
+def recv_message(sock, conn, timeout=TIMEOUT, decoder=None):
     """
     Receives a message from a given socket and logs it.
+    When a frame decoder is given, reads until a whole frame is received,
+    and returns messages left over from previous reads first.
+
+    :param sock: connected target socket
+    :param conn: connection info string
+    :param timeout: socket recv timeout, 0 to only read what has already arrived
+    :param decoder: connection frame decoder, None for unframed messages
+    :type sock: socket.socket
+    :type conn: str
+    :type timeout: Union[float, int]
+    :type decoder: FrameDecoder
+    """
+
+    if decoder is None:
+        sock.settimeout(timeout)
+        try:
+            msg = sock.recv(BUFF).decode()
+        except (TimeoutError, BlockingIOError):  # A zero timeout makes the socket non-blocking
+            return None
+
+        if logger.traces(conn):
+            logger.write(conn, f"<<<<< {msg}")
+        return break_message(msg)
+
+    deadline = None if timeout is None else monotonic() + timeout
+    while not decoder.messages:
+        sock.settimeout(None if deadline is None else max(deadline - monotonic(), 0))
+        try:
+            if not decoder.recv_into(sock):  # Connection closed
+                return None
+        except (TimeoutError, BlockingIOError):  # Past the deadline, the last read doesn't wait at all
+            return None
+
+    msg = decoder.messages.popleft()
+    if logger.traces(conn):
+        logger.write(conn, f"<<<<< {msg}")
+    return msg
+
+
+def recv_first_message(sock, conn, timeout=TIMEOUT) -> (Union[Message, None], Union[FrameDecoder, None]):
+    """
+    Receives the first message of a connection and detects its wire mode.
+    A framed connection starts with the zero high byte of a length prefix, which is never a message code.
+    Returns the message and a frame decoder for the connection, or None as decoder for unframed connections.
 
     :param sock: connected target socket
     :param conn: connection info string
@@ -228,29 +1212,372 @@ def recv_message(sock, conn, timeout=TIMEOUT):
 
     sock.settimeout(timeout)
     try:
-        msg = sock.recv(BUFF).decode()
+        first = sock.recv(1, socket.MSG_PEEK)
     except TimeoutError:
+        return None, None
+
+    if first == b"\0":
+        decoder = FrameDecoder()
+        return recv_message(sock, conn, timeout, decoder), decoder
+
+    return recv_message(sock, conn, timeout), None
+
+
+async def send_message_async(writer, conn, msg, framed=False) -> None:
+    """
+    Sends an unencoded message to a given stream writer and logs it - see send_messages_async.
+
+    :param writer: connected target stream writer
+    :param conn: connection info string
+    :param msg: message string, or encoded message bytes
+    :param framed: send as a length-prefixed frame
+    :type writer: asyncio.StreamWriter
+    :type conn: str
+    :type msg: Union[str, bytes]
+    :type framed: bool
+    :raises TimeoutError: if the peer didn't read in time
+    """
+
+    await send_messages_async(writer, conn, (msg,), framed)
+
+
+async def send_messages_async(writer, conn, msgs, framed=False) -> None:
+    """
+    Sends a batch of unencoded messages to a given stream writer and logs them.
+    The messages are written to the transport together before draining once,
+    the transport handles partial writes, and draining waits up to SEND_TIMEOUT for a slow peer.
+
+    :param writer: connected target stream writer
+    :param conn: connection info string
+    :param msgs: message strings, or encoded message bytes, in order
+    :param framed: send as length-prefixed frames
+    :type writer: asyncio.StreamWriter
+    :type conn: str
+    :type msgs: Iterable[Union[str, bytes]]
+    :type framed: bool
+    :raises TimeoutError: if the peer didn't read in time
+    """
+
+    msgs = list(msgs)
+    writer.writelines(frame_messages(msgs, framed))
+    await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)  # Past its buffer limit, a slow peer holds the writer back
+
+    if logger.traces(conn):
+        for msg in msgs:
+            logger.write(conn, f">>>>> {msg if isinstance(msg, str) else message_text(msg)}")
+
+
+async def recv_message_async(reader, conn, timeout=TIMEOUT, decoder=None):
+    """
+    Receives a message from a given stream reader and logs it.
+    Returns None on timeout or disconnection, just like recv_message.
+
+    :param reader: connected target stream reader
+    :param conn: connection info string
+    :param timeout: recv timeout, None to wait indefinitely
+    :param decoder: connection frame decoder, None for unframed messages
+    :type reader: asyncio.StreamReader
+    :type conn: str
+    :type timeout: Union[float, int, None]
+    :type decoder: FrameDecoder
+    """
+
+    try:
+        if decoder is None:
+            msg = break_message((await asyncio.wait_for(reader.read(BUFF), timeout)).decode())
+        else:
+            msg = await asyncio.wait_for(_recv_frame_async(reader, decoder), timeout)
+    except (asyncio.TimeoutError, ConnectionError):
         return None
 
-    log(conn, f"<<<<< {msg}")
-    return break_message(msg)
+    if msg:
+        if logger.traces(conn):
+            logger.write(conn, f"<<<<< {msg}")
+    return msg
+
+
+async def _recv_frame_async(reader, decoder):
+    """
+    Reads from a stream reader until the decoder holds a complete message, and returns it.
+    Returns None if the connection was closed.
+    """
+
+    while not decoder.messages:
+        data = await reader.read(BUFF)
+        if not data:
+            return None
+        decoder.feed(data)
+
+    return decoder.messages.popleft()
+
+
+async def recv_first_message_async(reader, conn, timeout=TIMEOUT) -> (Union[Message, None], Union[FrameDecoder, None]):
+    """
+    Asyncio counterpart of recv_first_message.
+
+    :param reader: connected target stream reader
+    :param conn: connection info string
+    :param timeout: recv timeout
+    :type reader: asyncio.StreamReader
+    :type conn: str
+    :type timeout: Union[float, int]
+    """
+
+    try:
+        data = await asyncio.wait_for(reader.read(BUFF), timeout)
+    except (asyncio.TimeoutError, ConnectionError):
+        return None, None
+
+    if not data.startswith(b"\0"):
+        msg = data.decode()
+        if logger.traces(conn):
+            logger.write(conn, f"<<<<< {msg}")
+        return break_message(msg), None
+
+    decoder = FrameDecoder()
+    try:
+        decoder.feed(data)
+    except Error.Protocol.FrameTooLarge:
+        return None, decoder
+    return await recv_message_async(reader, conn, timeout, decoder), decoder
 
 
-def load_questions() -> dict[str, list[Question]]:
+def read_question_file(path):
+    """
+    Yields the questions of a topic text file one at a time,
+    as lists of the question text followed by its 4 answers, correct first.
+
+    :param path: topic text file path
+    :type path: str
+    :raises Error.Protocol.InvalidQuestionBank: if a question does not have exactly 4 answers
+    """
+
+    with open(path, "r", encoding="utf-8") as f:
+        q = []
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                q.append(line)
+                continue
+
+            if q:  # Blank line ends a question
+                if len(q) != 5:
+                    raise Error.Protocol.InvalidQuestionBank
+                yield q
+                q = []
+
+        if q:
+            if len(q) != 5:
+                raise Error.Protocol.InvalidQuestionBank
+            yield q
+
+
+def load_questions(src="questions") -> QuestionBank:
     """
     Loads all questions from ./questions directory
-    and returns a dict of questions by topic.
+    and returns a question bank.
+
+    :param src: questions directory
+    :type src: str
     """
 
-    questions = {topic: [] for topic in TOPICS}
+    return build_bank({topic: itertools.chain.from_iterable(read_question_file(f"{src}/{topic}.txt"))
+                       for topic in SECTIONS})
+
 
-    for topic in TOPICS:
-        if topic != "mix":
-            with open(f"questions/{topic}.txt", "r") as f:
-                topic_questions = f.read().split("\n\n")
-                for q in topic_questions:
-                    q = q.split('\n')
-                    questions[topic].append(Question(q[0], q[1], q[2], q[3], q[4], 1))
-                    questions["mix"].append(Question(q[0], q[1], q[2], q[3], q[4], 1))
+def build_bank(sections) -> QuestionBank:
+    """
+    Builds a question bank from the texts of its sections.
+
+    :param sections: texts of every section by topic - every question text followed by its 4 answers, correct first
+    :type sections: dict[str, Iterable[str]]
+    """
+
+    texts = []
+    topics = {}
+
+    for topic in SECTIONS:
+        start = len(texts) // 5
+        texts.extend(sections[topic])
+        topics[topic] = range(start, len(texts) // 5)
+
+    topics["mix"] = range(0, len(texts) // 5)
+    return QuestionBank(tuple(texts), topics)
+
+
+def section_digest(texts):
+    """
+    Returns the sha256 hash object of the texts of a bank section - every text prefixed with its encoded length.
+
+    :param texts: section texts
+    :type texts: Iterable[str]
+    """
+
+    h = hashlib.sha256()
+    for text in texts:
+        data = text.encode()
+        h.update(len(data).to_bytes(4, "big") + data)
+    return h
+
+
+def compile_bank(path=BANK_PATH, src="questions") -> int:
+    """
+    Compiles the topic text files into a single binary question bank and returns the number of questions.
+    The text files are streamed, so compiling does not hold the questions in memory.
+
+    :param path: compiled bank path
+    :param src: questions directory
+    :type path: str
+    :type src: str
+    """
+
+    return write_bank(path, {topic: itertools.chain.from_iterable(read_question_file(f"{src}/{topic}.txt"))
+                             for topic in SECTIONS})
+
+
+def write_bank(path, sections) -> int:
+    """
+    Writes a compiled question bank from the texts of its sections and returns the number of questions.
+    Topics are written one after the other, followed by an offsets index of all strings and a topic table
+    that also holds the digest of every section, hashed while writing it - see QuestionBank.sections.
+
+    :param path: compiled bank path
+    :param sections: texts of every section by topic - every question text followed by its 4 answers, correct first
+    :type path: str
+    :type sections: dict[str, Iterable[str]]
+    """
+
+    offsets = array.array("Q")
+    topics = {}
+    count = 0
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(bytes(BANK_HEADER.size))  # Header is written last
+        pos = BANK_HEADER.size
+        offsets.append(pos)
+
+        for topic in SECTIONS:
+            start = count
+            h = hashlib.sha256()
+            for text in sections[topic]:
+                data = text.encode()
+                h.update(len(data).to_bytes(4, "big") + data)  # Same as section_digest, without reading twice
+                pos += f.write(data)
+                offsets.append(pos)
+            count = (len(offsets) - 1) // 5
+            topics[topic] = (start, count, h.digest())
+
+        topics["mix"] = (0, count, b"")  # Spans every section - has no digest of its own
+
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        index_offset = pos
+        offsets.tofile(f)
+
+        topics_offset = f.tell()
+        for topic, (start, end, digest) in topics.items():
+            f.write(BANK_TOPIC.pack(topic.encode(), start, end, digest))
+
+        f.seek(0)
+        f.write(BANK_HEADER.pack(BANK_MAGIC, BANK_VERSION, len(topics), count, index_offset, topics_offset))
+
+    os.replace(path + ".tmp", path)  # Replace a bank that might be mapped by a running server at once
+    return count
+
+
+def map_questions(path=BANK_PATH) -> QuestionBank:
+    """
+    Memory-maps a compiled question bank and returns a question bank that decodes questions on access.
+    Section digests are read from the bank, so the questions are never hashed again.
+
+    :param path: compiled bank path
+    :type path: str
+    :raises Error.Protocol.InvalidQuestionBank: if the file is not a compiled question bank
+    """
+
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buffer) < BANK_HEADER.size:
+        raise Error.Protocol.InvalidQuestionBank
+
+    magic, version, topic_count, count, index_offset, topics_offset = BANK_HEADER.unpack_from(buffer, 0)
+    if magic != BANK_MAGIC or version != BANK_VERSION:
+        raise Error.Protocol.InvalidQuestionBank
+
+    topics = {}
+    sections = {}
+    for i in range(0, topic_count):
+        topic, start, end, digest = BANK_TOPIC.unpack_from(buffer, topics_offset + i * BANK_TOPIC.size)
+        topic = topic.rstrip(b"\0").decode()
+        topics[topic] = range(start, end)
+        if topic in SECTIONS:
+            sections[topic] = digest.hex()
+
+    if list(sections) != list(SECTIONS):
+        raise Error.Protocol.InvalidQuestionBank
+
+    return QuestionBank(MappedTexts(buffer, index_offset, count * 5), topics, sections)
+
+
+def load_bank(path=BANK_PATH) -> QuestionBank:
+    """
+    Maps the compiled question bank if there is one,
+    otherwise loads the questions from the text files.
+    Recompile the bank after editing the text files.
+
+    :param path: compiled bank path
+    :type path: str
+    """
+
+    if os.path.exists(path):
+        return map_questions(path)
+    return load_questions()
+
+
+def pack_section(texts) -> list[bytes]:
+    """
+    Compresses the texts of a bank section for a bank sync, split into chunks that fit in a frame each.
+
+    :param texts: section texts
+    :type texts: list[str]
+    """
+
+    data = zlib.compress("\n".join(texts).encode(), 9)  # Texts are lines of the topic files - never contain "\n"
+    return [data[i:i + BANK_CHUNK] for i in range(0, len(data), BANK_CHUNK)]
+
+
+def unpack_section(chunks) -> list[str]:
+    """
+    Decompresses the texts of a bank section received in a bank sync.
+
+    :param chunks: received chunks, in order
+    :type chunks: list[bytes]
+    :raises Error.Protocol.InvalidQuestionBank: if the chunks don't hold a valid section
+    """
+
+    try:
+        data = zlib.decompress(b"".join(chunks)).decode()
+    except (zlib.error, UnicodeDecodeError):
+        raise Error.Protocol.InvalidQuestionBank
+
+    texts = data.split("\n") if data else []
+    if len(texts) % 5:
+        raise Error.Protocol.InvalidQuestionBank
+    return texts
+
+
+def merge_bank(bank, received) -> QuestionBank:
+    """
+    Returns the question bank made of the sections received in a bank sync,
+    and the sections of a local bank that were not sent, as the peer already holds them.
+
+    :param bank: local question bank, None if there is none
+    :param received: compressed chunks of the received sections by topic
+    :type bank: Union[QuestionBank, None]
+    :type received: dict[str, list[bytes]]
+    :raises Error.Protocol.InvalidQuestionBank: if a received section is not valid
+    """
 
-    return questions
+    return build_bank({topic: unpack_section(received[topic]) if topic in received else
+                       bank.texts(topic) if bank else [] for topic in SECTIONS})
@@ -5,22 +5,269 @@
 
 from protocol import *
 from typing import Union
-import random
+import asyncio
+import collections
+import functools
+import http.server
+import itertools
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import selectors
 import socket
+import sys
 import threading
+from multiprocessing import reduction
 from time import sleep
 from string import ascii_letters
 
+# Server constants
+SERVER_MODES = ["threaded", "asyncio"]  # Available server engines - see parse_args
+WHEEL_TICK = 0.05  # Timer wheel resolution (seconds)
+WHEEL_SLOTS = 256  # Timer wheel slots - timers further than a turn of the wheel wait for extra turns
+ROOM_MAX = 50  # Largest number of players in a game - see parse_args
+ROOM_WAIT = DW  # Time the longest waiting client waits for a full room before a smaller one starts (seconds)
+WORKERS = hasattr(socket, "SO_REUSEPORT")  # Workers share the port and pass sockets to each other - Unix only
+RECV_ERRORS = (OSError, UnicodeDecodeError, Error.Protocol.UnknownMessageCode, Error.Protocol.MessageValidationError,
+               Error.Protocol.FrameTooLarge)  # Failures of a single connection while receiving - see recv_answer
+
+# Server matchmaking
+class MatchQueue:
+    def __init__(self):
+        """
+        FIFO waiting list of a single topic, with O(1) enqueue, dequeue and cancel.
+        Clients are keyed by address, so a stale connection from the same address is replaced.
+        Every topic has its own lock, so matchmaking in one topic never waits for another.
+        ADD LOCK MANUALLY (queue.lock)
+        """
+
+        self.clients = collections.OrderedDict()  # Waiting clients by address, in order of arrival
+        self.lock = threading.Lock()  # Lock for accessing this waiting list
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __contains__(self, client):
+        return self.clients.get(client.addr) is client
+
+    def enqueue(self, client) -> None:
+        """
+        Adds a client to the end of the waiting list.
+        A client that is already waiting keeps its place.
+
+        :param client: client to add
+        :type client: Client
+        """
+
+        if client not in self:
+            self.clients.pop(client.addr, None)  # Drop any inactive connection from same address
+            self.clients[client.addr] = client
+
+    def dequeue(self, client) -> Union["Client", None]:
+        """
+        Removes the current client from the waiting list, and pops the longest waiting client,
+        or returns None if no other client is waiting.
+
+        :param client: current client
+        :type client: Client
+        """
+
+        self.cancel(client)
+        if self.clients:
+            return self.clients.popitem(last=False)[1]
+
+    def take(self, client, count, least=None) -> Union[list["Client"], None]:
+        """
+        Removes the current client from the waiting list, and pops up to the given number of longest waiting clients,
+        or returns None if fewer than least other clients are waiting - then the current client keeps its place.
+
+        :param client: current client
+        :param count: largest number of clients to pop
+        :param least: smallest number of clients to pop, count if None
+        :type client: Client
+        :type count: int
+        :type least: int
+        """
+
+        waiting = len(self.clients) - (client in self)
+        if waiting < (count if least is None else least):
+            return None
+
+        self.cancel(client)
+        return [self.clients.popitem(last=False)[1] for _ in range(0, min(count, waiting))]
+
+    def room(self, client, size) -> Union[list["Client"], None]:
+        """
+        Pops the other players of a room for the current client, or returns None if a room can't start yet.
+        A room starts once it is full, or with every waiting client once the longest waiting one
+        (or the current client) has been searching for ROOM_WAIT, so a smaller group never waits forever.
+
+        :param client: current client
+        :param size: largest number of players in a room
+        :type client: Client
+        :type size: int
+        """
+
+        first = next(iter(self.clients.values()), None)
+        since = min((c.searching for c in (first, client) if c and c.searching is not None), default=None)
+        patient = since is not None and monotonic() - since >= ROOM_WAIT
+        return self.take(client, size - 1, 1 if patient else None)
+
+    def cancel(self, client) -> bool:
+        """
+        Removes a client from the waiting list.
+        Returns True if the client was waiting, False otherwise.
+
+        :param client: client to remove
+        :type client: Client
+        """
+
+        if client in self:
+            del self.clients[client.addr]
+            return True
+        return False
+
+
+WaitingEntry = collections.namedtuple("WaitingEntry", ["addr", "worker", "cid"])  # Coordinator waiting list entry
+
+
+# Server timers
+class Timer:
+    def __init__(self, callback, args, rounds):
+        """
+        Timer of a timer wheel.
+
+        :param callback: function called once the timer expires
+        :param args: callback arguments
+        :param rounds: turns of the wheel left before the timer expires
+        :type callback: function
+        :type args: tuple
+        :type rounds: int
+        """
+
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False  # Also set once fired, so a timer never fires twice
+
+
+class TimerWheel:
+    def __init__(self, tick=WHEEL_TICK, size=WHEEL_SLOTS):
+        """
+        Hashed timer wheel shared by every game and connection of the server process.
+        Timers are hashed into slots by their expiry tick, so scheduling and canceling a timer are O(1),
+        and a single thread advances the wheel every tick, firing the expired timers of the current slot.
+        Callbacks run on the wheel thread, so they only wake the thread or task waiting for the timer.
+
+        :param tick: wheel resolution (seconds)
+        :param size: number of slots
+        :type tick: float
+        :type size: int
+        """
+
+        self.tick = tick
+        self.slots = [[] for _ in range(0, size)]
+        self.cursor = 0  # Slot of the current tick
+        self.lock = threading.Lock()  # Lock for accessing the slots and timers
+
+    def start(self) -> None:
+        """
+        Starts advancing the wheel on a daemon thread.
+        """
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def schedule(self, delay, callback, *args) -> Timer:
+        """
+        Schedules a callback to be called after a delay, rounded up to the wheel resolution.
+
+        :param delay: time until the timer expires (seconds)
+        :param callback: function called once the timer expires
+        :param args: callback arguments
+        :type delay: Union[float, int]
+        :type callback: function
+        """
+
+        ticks = max(math.ceil(delay / self.tick), 1)
+        size = len(self.slots)
+
+        with self.lock:
+            timer = Timer(callback, args, (ticks - 1) // size)
+            self.slots[(self.cursor + ticks) % size].append(timer)
+        return timer
+
+    def cancel(self, timer) -> None:
+        """
+        Cancels a timer - its callback is not called afterwards, unless it has already been fired.
+        The timer is dropped from its slot the next time the wheel passes it.
+
+        :param timer: scheduled timer
+        :type timer: Timer
+        """
+
+        with self.lock:
+            timer.cancelled = True
+
+    def run(self) -> None:
+        """
+        Wheel thread target function.
+        """
+
+        next_tick = monotonic()
+        while True:
+            next_tick += self.tick
+            sleep(max(next_tick - monotonic(), 0))
+
+            expired = []
+            with self.lock:
+                self.cursor = (self.cursor + 1) % len(self.slots)
+                pending = []
+
+                for timer in self.slots[self.cursor]:
+                    if timer.cancelled:
+                        continue
+                    if timer.rounds:
+                        timer.rounds -= 1
+                        pending.append(timer)
+                    else:
+                        timer.cancelled = True
+                        expired.append(timer)
+
+                self.slots[self.cursor] = pending
+
+            for timer in expired:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    log("T", f"Timer callback failed: {e!r}", ERROR)
+
+
 # Server global variable
-waitlist = {k: [] for k in TOPICS}  # Waiting list by topic dict - see server documentation
-score = {}  # Score dict - see server documentation
-questions = {}  # [THREAD READONLY] questions by topic dict - see server documentation
-lock = threading.Lock()  # Lock for accessing global vars above
+waitlist = {k: MatchQueue() for k in TOPICS}  # Waiting list by topic dict, each with its own lock - see server documentation
+questions = None  # [THREAD READONLY] question bank - see server documentation
+frames = None  # Pre-encoded question messages of the question bank, thread-safe
+bank_sync = {}  # Pre-encoded bank sync messages by topic, built on first use under bank_sync_lock - see section_sync
+bank_sync_lock = threading.Lock()
+coordinator = None  # Matchmaking coordinator link of a worker process, None unless running with workers
+timers = None  # Timer wheel of answer deadlines and idle connections, thread-safe
+room_size = 2  # Largest number of players in a game - see parse_args
+
+# Server metrics - see serve_metrics
+OPEN_CONNECTIONS = metrics.gauge("trivia_open_connections", "Open client connections.")
+ACTIVE_GAMES = metrics.gauge("trivia_active_games", "Games in progress.")
+GAMES_FINISHED = metrics.counter("trivia_games_finished_total", "Games played to the end.")
+FORFEITS = metrics.counter("trivia_forfeits_total", "Players who disconnected or missed an answer deadline during a game.")
+MATCH_WAIT = metrics.histogram("trivia_matchmaking_wait_seconds", "Time from the first search query to the game start.")
+BANK_SYNCS = metrics.counter("trivia_bank_syncs_total", "Bank sections sent to clients in the handshake.")
+ANSWER_LATENCY = metrics.histogram("trivia_answer_latency_seconds", "Time from sending a question to receiving its answer.")
+metrics.gauge("trivia_waitlist_depth", "Clients waiting for a game.", lambda: {k: len(q) for k, q in waitlist.items()}, "topic")
+metrics.gauge("trivia_threads", "Running threads.", threading.active_count)
 
 
 # Server classes
 class Client:
-    def __init__(self, name, sock, addr, cid, thread=None):
+    def __init__(self, name, sock, addr, cid, thread=None, decoder=None, version=V1):
         """
         Represents a typical client.
 
@@ -29,37 +276,377 @@ class Client:
         :param addr: client address tuple
         :param cid: client id
         :param thread: client-handling stoppable thread
+        :param decoder: frame decoder of a framed connection, None for unframed connections
+        :param version: wire format version negotiated in the handshake
         :type name: str
         :type sock: socket.socket
         :type addr: (str, int)
         :type cid: str
         :type thread: ServerThread
+        :type decoder: FrameDecoder
+        :type version: int
         """
 
         self.name = name
         self.sock = sock
         self.addr = addr
         self.cid = cid
+        self.sid = cid  # Session id - the client id outside of games
         self.thread = thread
+        self.decoder = decoder
+        self.version = version
+        self.out = OutputBuffer(sock) if sock else None  # Output buffer of the connection (threaded engine)
+        self.host = None  # Client whose thread runs the game this one was taken into while waiting - itself for the host
+        self.room = None  # Other players of the game run by this client's thread, if it's the host
+        self.released = threading.Event()  # Set once this client's thread has stopped reading from it for a game
+        self.waker = None  # Socket pair used to wake this client's thread once taken into a game
+        self.searching = None  # Time of the first search query (monotonic)
+
+    def send(self, *msgs) -> None:
+        """
+        Sends messages to the client in its wire mode, coalesced into as few writes as possible.
+
+        :param msgs: message strings, or encoded message bytes, in order
+        :type msgs: Union[str, bytes]
+        """
+
+        send_messages(self.sock, self.cid, msgs, self.decoder is not None, self.out)
+
+    def recv(self, timeout=TIMEOUT) -> Union[Message, None]:
+        """
+        Receives a message from the client in its wire mode.
+
+        :param timeout: socket recv timeout
+        :type timeout: Union[float, int]
+        """
+
+        return recv_message(self.sock, self.cid, timeout, self.decoder)
+
+    def join(self, host) -> None:
+        """
+        Takes this waiting client into a game and wakes its thread.
+        The thread of the host runs the game, and the threads of the other players stop reading and exit.
+        ADD LOCK MANUALLY (lock of the topic's waiting list)
+
+        :param host: waiting client whose thread runs the game, with its room set
+        :type host: Client
+        """
+
+        self.host = host
+        self.waker[1].send(b"\0")
+
+    def wait_for_query(self) -> Union[Message, None]:
+        """
+        Sleeps until the client is taken into a game or sends another query, without polling.
+        Returns the query, or None once taken into a game, disconnected or sent an invalid message.
+        """
+
+        if self.decoder is None or not self.decoder.messages:
+            with selectors.DefaultSelector() as sel:
+                sel.register(self.sock, selectors.EVENT_READ)
+                sel.register(self.waker[0], selectors.EVENT_READ)
+                sel.select()
+
+        if self.host:
+            return None
+        try:
+            return self.recv()
+        except RECV_ERRORS:  # Handled as a disconnection, so the client leaves the waiting list
+            return None
+
+    def expire(self) -> None:
+        """
+        Timer callback of an idle connection - shuts the socket down,
+        so the thread reading from it sees the connection closed.
+        """
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def reset(self) -> None:
+        """
+        Prepares the client for another search, once its game is over.
+        """
+
+        if self.host:  # Consume the wake-up of the finished game
+            self.waker[0].recv(1)
+
+        self.host = None
+        self.room = None
+        self.released.clear()
+        self.searching = None
+        self.cid = self.sid
+
+    def close(self) -> None:
+        """
+        Closes the client socket and its wake-up socket pair.
+        """
+
+        self.sock.close()
+        if self.waker:
+            for sock in self.waker:
+                sock.close()
+        OPEN_CONNECTIONS.dec()
+
+
+class AsyncClient(Client):
+    def __init__(self, name, reader, writer, addr, cid, decoder=None, version=V1):
+        """
+        Represents a client served by the asyncio engine.
+
+        :param name: nickname string chosen by the client, passed in 'I' message.
+        :param reader: client stream reader
+        :param writer: client stream writer
+        :param addr: client address tuple
+        :param cid: client id
+        :param decoder: frame decoder of a framed connection, None for unframed connections
+        :param version: wire format version negotiated in the handshake
+        :type name: str
+        :type reader: asyncio.StreamReader
+        :type writer: asyncio.StreamWriter
+        :type addr: (str, int)
+        :type cid: str
+        :type decoder: FrameDecoder
+        :type version: int
+        """
+
+        super().__init__(name, None, addr, cid, decoder=decoder, version=version)
+        self.reader = reader
+        self.writer = writer
+        self.writer.transport.set_write_buffer_limits(high=OUT_LIMIT)  # Backpressure past OUT_LIMIT unsent bytes
+        self.matched = None  # Future resolved once another task takes this client into a game
+        self.released = asyncio.Event()  # Set once this client's task has stopped reading from it for a game
+
+    async def send(self, *msgs) -> None:
+        """
+        Sends messages to the client in its wire mode, draining once after writing all of them.
+
+        :param msgs: message strings, or encoded message bytes, in order
+        :type msgs: Union[str, bytes]
+        """
+
+        await send_messages_async(self.writer, self.cid, msgs, self.decoder is not None)
+
+    async def recv(self, timeout=TIMEOUT) -> Union[Message, None]:
+        """
+        Receives a message from the client in its wire mode.
+
+        :param timeout: recv timeout, None to wait indefinitely
+        :type timeout: Union[float, int, None]
+        """
+
+        return await recv_message_async(self.reader, self.cid, timeout, self.decoder)
+
+    def join(self, host) -> None:
+        """
+        Takes this waiting client into a game and wakes its task.
+        The task of the host runs the game, and the tasks of the other players stop reading and exit.
+
+        :param host: waiting client whose task runs the game, with its room set
+        :type host: AsyncClient
+        """
+
+        self.host = host
+        self.matched.set_result(host)
+
+    def expire(self) -> None:
+        """
+        Timer callback of an idle connection - closes the stream, so the task reading from it
+        sees the connection closed. Has to be called on the event loop.
+        """
+
+        self.writer.close()
+
+    def reset(self) -> None:
+        """
+        Prepares the client for another search, once its game is over.
+        """
+
+        self.matched = None
+        self.host = None
+        self.room = None
+        self.released.clear()
+        self.searching = None
+        self.cid = self.sid
+
+    def close(self) -> None:
+        """
+        Closes the client stream.
+        """
+
+        self.writer.close()
+        OPEN_CONNECTIONS.dec()
+
+
+class Game:
+    def __init__(self, topic, players):
+        """
+        State of a single game - its players and their scores.
+        A game is owned by the thread (or task) managing it, which also collects the answers,
+        so games need no lock and are freed once over.
+        Assigns the in-game client ids.
+
+        :param topic: game topic
+        :param players: players of the game, 2 up to ROOM_MAX
+        :type topic: str
+        :type players: list[Client]
+        """
+
+        self.tid = players[0].cid  # Game id
+        self.topic = topic
+        self.players = list(players)
+        self.score = [0] * len(players)  # Score by player index, "F" if the player has forfeited
+        self.asked = None  # Time the current question was sent (monotonic)
+        self.expired = None  # Number of the last question whose answer deadline has passed
+        self.waker = None  # Socket pair used by the timer wheel to wake the game thread (threaded engine)
+        self.selector = None  # Selector of the player sockets and the waker, kept for the whole game (threaded engine)
+
+        # New client ids
+        for i, player in enumerate(self.players, 1):
+            player.cid = f"{self.tid}-{i}"
+
+        now = monotonic()
+        for player in self.players:
+            if player.searching is not None:
+                MATCH_WAIT.observe(now - player.searching)
+
+    def record_answer(self, i, msg, correct) -> None:
+        """
+        Adds score to a player according to its answer message.
+        A player whose message is not a valid answer forfeits, like a player who has disconnected.
+
+        :param i: player index
+        :param msg: answer message, None if the player has disconnected
+        :param correct: correct answer
+        :type i: int
+        :type msg: Message
+        :type correct: int
+        """
+
+        if self.score[i] == "F":
+            return
+
+        try:
+            ans = int(msg.fields[0]) if msg and msg.code == "A" else None
+        except (IndexError, ValueError):
+            ans = None
+
+        if ans is None:
+            self.score[i] = "F"  # Flag that client has disconnected
+            return
+
+        ANSWER_LATENCY.observe(monotonic() - self.asked)
+        if ans == correct:
+            self.score[i] += 1
+
+    def expire(self, question) -> None:
+        """
+        Timer callback of an answer deadline - flags the question and wakes the game thread.
+
+        :param question: question number
+        :type question: int
+        """
+
+        self.expired = question
+        try:
+            self.waker[1].send(b"\0")
+        except OSError:  # Game already over
+            pass
+
+    def close(self) -> None:
+        """
+        Closes the game selector and wake-up socket pair.
+        """
+
+        if self.selector:
+            self.selector.close()
+        if self.waker:
+            for sock in self.waker:
+                sock.close()
+
+    def drop_forfeited(self) -> None:
+        """
+        Removes the players who have forfeited from the game and closes their connections.
+        The rest of the players keep playing.
+        """
+
+        if "F" not in self.score:
+            return
+
+        players, score = [], []
+        for player, points in zip(self.players, self.score):
+            if points == "F":
+                log(self.tid, f"{player.cid} forfeited. Closing its socket.")
+                FORFEITS.inc()
+                player.close()
+            else:
+                players.append(player)
+                score.append(points)
+
+        self.players, self.score = players, score
+
+    def results(self, prev_ans) -> functools.partial:
+        """
+        Decides the game results, and returns a function encoding the results message in a given wire format version -
+        with the nickname of the player with the highest score, or "B" if more than one player has it.
+        The results are decided once, before any of them is sent, so a player failing meanwhile doesn't change them.
+
+        :param prev_ans: answer of the last question
+        :type prev_ans: int
+        """
+
+        best = max((points for points in self.score if points != "F"), default=0)
+        leaders = [player for player, points in zip(self.players, self.score) if points == best]
+
+        return functools.partial(encode_message, "R", leaders[0].name if len(leaders) == 1 else "B", prev_ans)
+
+
+class EncodedMessage(dict):
+    def __init__(self, encode):
+        """
+        Encoded message and its frame header by wire format version, each encoded the first time it's needed,
+        so a broadcast encodes a message once for every format used in the game.
+
+        :param encode: function returning the encoded message in a given wire format version
+        :type encode: function
+        """
+
+        super().__init__()
+        self.encode = encode
+
+    def __missing__(self, version):
+        msg = self.encode(version=version)
+        self[version] = msg, FRAME_HEADER.pack(len(msg))
+        return self[version]
+
+    def __str__(self):
+        return " | ".join(message_text(msg) for msg, _ in self.values())
 
 
 class ServerThread(StoppableThread):
-    def __init__(self, sock, addr, cid):
+    def __init__(self, sock, addr, cid, client=None):
         """
         Client-handling thread.
 
         :param sock: connected client socket
         :param addr: client address tuple
         :param cid: client id
+        :param client: client whose session continues after a game, None for a new connection
         :type sock: socket.socket
         :type addr: (str, int)
         :type cid: str
+        :type client: Client
         """
 
         self.sock = sock
         self.addr = addr
         self.cid = cid
-        super().__init__(self.handle_client)  # Initialize a Stoppable Thread with handle_client as target function
+        self.client = client
+
+        # Initialize a Stoppable Thread with handle_client (or handle_session) as target function
+        super().__init__(self.handle_client if client is None else self.handle_session)
 
     def handle_client(self) -> None:
         """
@@ -67,142 +654,332 @@ class ServerThread(StoppableThread):
         """
 
         log(self.cid, f"New connection from {self.addr}")
-        msg = recv_message(self.sock, self.cid)  # Get 'I' authentication message
+        OPEN_CONNECTIONS.inc()
+        msg, decoder = recv_first_message(self.sock, self.cid)  # Get 'I' authentication message and wire mode
 
-        if msg.code == "I":
+        if msg and msg.code == "I":
             name = msg.fields[0]
+            client = Client(name, self.sock, self.addr, self.cid, self, decoder, negotiate_version(msg, decoder))
 
-            for ch in name:  # Validate nickname
-                if ch not in ascii_letters and not ch.isdigit() and ch != "_":
-                    log(self.cid, "Invalid nickname, sending error message and closing connection.")
-                    send_message(self.sock, self.cid, build_message("E", "INV"))  # Send error message
-                    return
+            if not valid_nickname(name):
+                log(self.cid, "Invalid nickname, sending error message and closing connection.", WARNING)
+                client.send(encode_message("E", "INV"))  # Send error message
+                client.close()
+                return
 
-            send_message(self.sock, self.cid, build_message("W"))  # Send welcome message
+            # Send the bank sections the client doesn't hold and the welcome message, as a single batch
+            client.send(*(sync_messages(msg) if client.version == V2 else ()), welcome_message(client))
+            self.search(client, client.recv())  # Get 'S' message (search for game)
 
-            msg = recv_message(self.sock, self.cid)  # Get 'S' message (search for game)
-            topic = None
+        else:
+            log(self.cid, f"Expected \"I\" query, instead got \"{msg.code if msg else None}\". Closing connection.", WARNING)
+            self.sock.close()
+            OPEN_CONNECTIONS.dec()
 
-            while msg.code == "S":
-                client = Client(name, self.sock, self.addr, self.cid, self)
-                match = match_clients(msg.fields[0], client)
-                topic = msg.fields[0]  # Save the topic which contains client in the waiting list
+    def handle_session(self) -> None:
+        """
+        Session-handling logic - waits for the next search query of a client that has finished a game.
+        """
 
-                if not match:
-                    msg = None
-                    while not msg:
-                        if self.stopped():
-                            """
-                            Because one of the threads removes the other client from the waiting list,
-                            and only one thread can access it at a time,
-                            one of them is bound to stop the other while it's still searching a match,
-                            specifically waiting for a S/C query from the client.
-                            """
+        timer = timers.schedule(IDLE, self.client.expire)
+        msg = self.client.recv(None)
+        timers.cancel(timer)
 
-                            log(self.cid, f"Game found, but managed by another thread. Closing thread.")
-                            return
+        self.search(self.client, msg)
 
-                        msg = recv_message(self.sock, self.cid, timeout=0.1)
+    def search(self, client, msg) -> None:
+        """
+        Searches a game for a client until it is matched, cancels or disconnects.
 
-                else:
-                    manage_game(msg.fields[0], client, match)
-                    break
+        :param client: current client
+        :param msg: first search query
+        :type client: Client
+        :type msg: Message
+        """
 
-            else:
-                if msg.code == "C":
-                    log(self.cid, f"Client canceled game. Closing connection.")
+        topic = None
 
-                    if topic:  # Remove client from waiting list
-                        with lock:
-                            for i in range(0, len(waitlist[topic])):
-                                c = waitlist[topic][i]
+        while msg and msg.code == "S":
+            topic = msg.fields[0]  # Save the topic which contains client in the waiting list
+            if client.searching is None:
+                client.searching = monotonic()
 
-                                if c.addr == self.addr:
-                                    waitlist[topic].pop(i)
+            try:
+                matched = match_clients(topic, client)
+            except OSError:  # Failed to send 'N' - leave the waiting list as if disconnected
+                msg = None
+                break
 
-                    self.sock.close()
+            if matched:
+                """
+                The thread of a waiting client only sleeps on its own socket and wake-up socket,
+                so the matched client is handed over to it and this thread is done.
+                """
 
-                else:
-                    log(self.cid, f"Expected \"S\" query, instead got \"{msg.code}\". Closing connection.")
-                    self.sock.close()
+                log(client.cid, f"Game found, but managed by the waiting client's thread. Closing thread.")
+                return
+
+            msg = client.wait_for_query()  # Sleep until taken into a game or queried again
+
+            if client.host:
+                join_game(topic, client)
+                return
 
+        if msg and msg.code == "C":
+            log(client.cid, f"Client canceled game. Closing connection.")
+        elif msg is None:
+            log(client.cid, f"Client disconnected or idle. Closing connection.")
         else:
-            log(self.cid, f"Expected \"I\" query, instead got \"{msg.code}\". Closing connection.")
-            self.sock.close()
+            log(client.cid, f"Expected \"S\" query, instead got \"{msg.code}\". Closing connection.", WARNING)
+
+        if topic:  # Remove client from waiting list
+            with waitlist[topic].lock:
+                waitlist[topic].cancel(client)
+
+            if client.host:  # Taken into a game at the same time - the game still has to be played
+                join_game(topic, client)
+                return
+
+        client.close()
 
 
 # Server static functions
-def recv_f(tid, target, correct) -> None:
+def valid_nickname(name) -> bool:
     """
-    Simple target function to get answer from user and add score accordingly.
+    Checks that a nickname is not empty, and only contains ascii letters, digits and underscores.
 
-    :param tid: thread id (key in score dict)
-    :param target: target client
-    :param correct: correct answer
-    :type tid: str
-    :type target: Client
-    :type correct: int
+    :param name: nickname string
+    :type name: str
     """
 
-    msg = recv_message(target.sock, target.cid, timeout=TIMEOUT + ANS)
-    if msg is None:
-        with lock:
-            score[tid][target.cid] = "F"  # Flag that client has disconnected
+    if not name:
+        return False
+    for ch in name:
+        if ch not in ascii_letters and not ch.isdigit() and ch != "_":
+            return False
+    return True
+
 
-    elif int(msg.fields[0]) == correct:
-        with lock:
-            score[tid][target.cid] += 1
+def negotiate_version(msg, decoder) -> int:
+    """
+    Returns the wire format version of a new connection, from its 'I' message -
+    "I~name~2~..." asks for the compact format, which is only used over framed connections.
+    Any other connection keeps the text format.
+
+    :param msg: 'I' authentication message
+    :param decoder: frame decoder of the connection, None for unframed connections
+    :type msg: Message
+    :type decoder: FrameDecoder
+    """
 
+    if decoder is not None and msg.fields[1:2] == [str(V2)]:
+        return V2
+    return V1
 
-def add_to_waitlist(topic, client) -> None:
+
+def sync_messages(msg) -> list[bytes]:
+    """
+    Returns the bank sync messages ("B") to send before welcoming a client of the compact format,
+    which needs the server question bank to resolve questions sent by index.
+    "I~name~2~digest~topic:digest~..." presents the digest of the client's bank, and of each of its sections.
+    Nothing is sent if the bank digests match - otherwise only the sections whose digests differ,
+    which is the whole bank for a client without one.
+
+    :param msg: 'I' authentication message
+    :type msg: Message
     """
-    Add a client to the waiting list of a given topic.
-    ADD LOCK MANUALLY
 
-    :param topic: chosen topic
-    :param client: client to add
+    if msg.fields[2:3] == [questions.digest()]:
+        return []
+
+    held = dict(field.partition(":")[::2] for field in msg.fields[3:])
+    stale = [topic for topic, digest in questions.sections().items() if held.get(topic) != digest]
+    BANK_SYNCS.inc(len(stale))
+    return [data for topic in stale for data in section_sync(topic)]
+
+
+def section_sync(topic) -> list[bytes]:
+    """
+    Returns the bank sync messages of a bank section.
+    A section is compressed by the first handshake that needs it, and its messages are kept for the next ones,
+    so starting the server never compresses the bank, and sections no client lacks are never compressed.
+
+    :param topic: section topic, one of SECTIONS
     :type topic: str
+    """
+
+    with bank_sync_lock:
+        if topic not in bank_sync:
+            i = SECTIONS.index(topic)
+            bank_sync[topic] = [encode_message("B", i, chunk, version=V2)
+                                for chunk in pack_section(questions.texts(topic))]
+        return bank_sync[topic]
+
+
+def welcome_message(client) -> bytes:
+    """
+    Builds the welcome message of a new connection, in the text format -
+    "W~2~digest" confirms the compact format, which the following messages use, with the digest of the server bank
+    the client should now hold, and "W" keeps the text format.
+
+    :param client: new client
     :type client: Client
     """
 
-    if topic not in TOPICS or topic not in waitlist.keys():
-        raise Error.Protocol.UnknownTopic
+    if client.version == V2:
+        return encode_message("W", V2, questions.digest())
+    return encode_message("W")
 
-    for i in range(0, len(waitlist[topic])):  # Make sure there isn't any inactive connection from same address
-        match = waitlist[topic][i]
-        if match.addr == client.addr:
-            waitlist[topic].pop(i)
 
-    if client not in waitlist[topic]:
-        waitlist[topic].append(client)
+def recv_answer(client) -> Union[Message, None]:
+    """
+    Receives the answer of a player, or returns None if its connection failed or it sent an invalid message,
+    so a problem with one player never ends the game of the rest.
+
+    :param client: player
+    :type client: Client
+    """
+
+    try:
+        return client.recv()
+    except RECV_ERRORS:
+        return None
 
 
-def get_from_waitlist(topic, client) -> Union[Client, None]:
+def read_answer(client) -> bool:
     """
-    Returns a client from waitlist of a given topic (FIFO),
-    or None if no matching client was found.
-    ADD LOCK MANUALLY
+    Reads what a readable player has sent without waiting, and returns True once its answer can be received
+    without waiting - a whole message has arrived, or the connection has closed.
+    A player who has only sent part of a frame so far never holds back the rest of the game.
+    An unframed message is read whole by a single recv, so it is never read here.
 
-    :param topic: given topic
-    :param client: current client
-    :type topic: str
+    :param client: player
     :type client: Client
+    :raises OSError: if the connection has failed
+    :raises Error.Protocol.FrameTooLarge: if the player sent a frame larger than MAX_FRAME
     """
 
-    if topic not in TOPICS or topic not in waitlist.keys():
-        raise Error.Protocol.UnknownTopic
+    if client.decoder is None or client.decoder.messages:
+        return True
 
-    for i in range(0, len(waitlist[topic])):
-        if waitlist[topic][i].addr != client.addr:  # if matching client is not the same as the current client
-            match = waitlist[topic].pop(i)  # pop from list
-            if client in waitlist[topic]:  # remove current client from waitlist
-                waitlist[topic].remove(client)
-            return match
+    client.sock.settimeout(0)
+    try:
+        return not client.decoder.recv_into(client.sock) or bool(client.decoder.messages)
+    except BlockingIOError:
+        return False
 
 
-def question_set(topic, length) -> set[Question]:
+def collect_answers(game, question, correct) -> None:
+    """
+    Gets an answer from every player at the same time and adds score accordingly.
+    Waits on all player sockets at once, without any extra thread, on a selector kept for the whole game.
+    A readable player is read without waiting, so only a whole answer is taken from it - see read_answer.
+    The answer deadline is kept by the timer wheel, which wakes the game once it has passed,
+    and a player who hasn't answered by then forfeits.
+
+    :param game: current game
+    :param question: question number
+    :param correct: correct answer
+    :type game: Game
+    :type question: int
+    :type correct: int
     """
-    Returns a random set of questions in given topic and in given length.
+
+    if game.selector is None:
+        game.waker = socket.socketpair()
+        game.selector = selectors.DefaultSelector()
+        game.selector.register(game.waker[0], selectors.EVENT_READ, None)
+
+    sel = game.selector
+    timer = timers.schedule(TIMEOUT + ANS, game.expire, question)
+
+    for i, player in enumerate(game.players):
+        if game.score[i] == "F":  # Failed before the question - never read from it
+            continue
+        elif player.decoder and player.decoder.messages:  # Answer already received with a previous message
+            game.record_answer(i, recv_answer(player), correct)
+        else:
+            sel.register(player.sock, selectors.EVENT_READ, i)
+
+    while len(sel.get_map()) > 1 and game.expired != question:
+        for key, _ in sel.select():
+            if key.data is None:  # Woken by the timer wheel - may be a late wake-up of a previous question
+                game.waker[0].recv(BUFF)
+                continue
+
+            i = key.data
+            try:
+                if not read_answer(game.players[i]):
+                    continue  # Only part of the answer has arrived - keep waiting for the rest until the deadline
+                msg = recv_answer(game.players[i])
+            except RECV_ERRORS:
+                msg = None
+
+            sel.unregister(key.fileobj)
+            game.record_answer(i, msg, correct)
+
+    timers.cancel(timer)
+
+    for key in list(sel.get_map().values()):  # No answer before the deadline
+        if key.data is not None:
+            sel.unregister(key.fileobj)
+            game.record_answer(key.data, None, correct)
+
+
+def broadcast(game, encode, players=None) -> None:
+    """
+    Sends the same message to the players of a game. The message is encoded and framed once per wire format,
+    and the same bytes are queued to the output buffer of every player in its wire mode, then sent to each
+    in a single write without waiting. Only then does it wait for players that haven't read everything yet,
+    all sharing a single deadline, so a slow player doesn't hold back the rest of the room.
+    A player whose connection has failed forfeits.
+
+    :param game: current game
+    :param encode: function returning the encoded message in a given wire format version
+    :param players: indices of the target players, every player if None
+    :type game: Game
+    :type encode: function
+    :type players: list[int]
+    """
+
+    encoded = EncodedMessage(encode)
+    targets = range(0, len(game.players)) if players is None else players
+
+    for i in targets:
+        player = game.players[i]
+        msg, header = encoded[player.version]
+        try:
+            if player.decoder is None:
+                player.out.write(msg)
+            else:
+                player.out.write(header, msg)
+        except OSError:
+            game.score[i] = "F"
+
+    for i in targets:  # Send to every player without waiting, one coalesced write each
+        if game.score[i] != "F":
+            try:
+                game.players[i].out.send()
+            except OSError:
+                game.score[i] = "F"
+
+    deadline = monotonic() + SEND_TIMEOUT
+    for i in targets:
+        player = game.players[i]
+        if player.out.pending and game.score[i] != "F":
+            try:
+                player.out.flush(max(deadline - monotonic(), 0))
+            except OSError:  # Includes a peer that didn't read in time
+                game.score[i] = "F"
+
+    if logger.traces(game.tid):
+        logger.write(game.tid, f">>>>> {encoded}")
+
+
+def question_set(topic, length) -> list[(int, int)]:
+    """
+    Returns a random list of questions in given topic and in given length,
+    as (question index, answer permutation id) pairs owned by the calling game.
 
     :param topic: chosen topic, as defined in the protocol
     :param length: number of questions to generate
@@ -212,134 +989,882 @@ def question_set(topic, length) -> set[Question]:
     of questions available in that topic
     """
 
-    if topic not in TOPICS or topic not in questions.keys():
+    if topic not in TOPICS:
         raise Error.Protocol.UnknownTopic
 
-    if len(questions[topic]) < length:
-        raise Error.Server.NotEnoughQuestions
-    elif len(questions[topic]) == length:
-        return set(questions[topic])
-    else:
-        available_q = list(questions[topic])  # NEW Temporary list of existing questions in the given topic
-        questions_set = set()
-
-        for i in range(0, length):
-            j = random.randint(0, len(available_q) - 1)  # pick a random not chosen question
-            questions_set.add(available_q[j])  # add to set
-            available_q.pop(j)  # remove question from list of not chosen questions
-        return questions_set
+    return questions.draw(topic, length)
 
 
 def match_clients(topic, client) -> Union[Client, None]:
     """
-    Searches a match for the current client and returns its client object.
-    If a match is not found, adds the client to the waiting list and returns None.
+    Searches a game for the current client and returns the client hosting it.
+    A game starts once enough clients are waiting to fill a room, or a smaller room once they have waited long enough
+    (see MatchQueue.room) - the longest waiting client hosts it.
+    If a game is not found, adds the client to the waiting list and returns None.
 
     :param topic: chosen topic
     :param client: current client
     :type topic: str
     :type client: Client
     """
-    with lock:
-        match = get_from_waitlist(topic, client)
+    if topic not in TOPICS or topic not in waitlist.keys():
+        raise Error.Protocol.UnknownTopic
+
+    with waitlist[topic].lock:
+        if client.host:  # Already taken into a game by another thread, which is waking this one
+            return None
+
+        members = waitlist[topic].room(client, room_size)
 
-        if not match:  # if match is not found
+        if not members:  # if there aren't enough waiting clients
             # add to waiting list send 'N' message with time to wait before retrying
-            add_to_waitlist(topic, client)
+            if not client.waker:
+                client.waker = socket.socketpair()
+
+            waitlist[topic].enqueue(client)
             log(client.cid, "Added to waitlist")
-            send_message(client.sock, client.cid, build_message("N", DW))
+            client.send(encode_message("N", DW, version=client.version))
         else:
-            # stop other thread and return the other client object
-            match.thread.stop()
-            return match
+            # wake the waiting threads - the host's thread takes over this client and the rest of the room
+            host = members[0]
+            host.room = [client] + members[1:]
+            for member in members:
+                member.join(host)
+            return host
 
 
-def manage_game(topic, client, match) -> None:
+def join_game(topic, client) -> None:
     """
-    In-game logic.
+    Stops reading from a client taken into a game. The thread of the host goes on to run the game.
 
-    :param client: main client
-    :param match: second client
     :param topic: game topic
+    :param client: current client
+    :type topic: str
     :type client: Client
-    :type match: Client
+    """
+
+    client.released.set()
+
+    if client.host is client:
+        manage_game(topic, client.room + [client])
+    else:
+        log(client.cid, f"Game found, but managed by the host client's thread. Closing thread.")
+
+
+def manage_game(topic, players) -> None:
+    """
+    In-game logic. Every question is encoded once per wire format and broadcast to the whole room.
+    Players who forfeit are dropped, and the rest keep playing as long as at least two are left.
+
+    :param topic: game topic
+    :param players: players of the game - the client that filled the room first, and the host last
     :type topic: str
+    :type players: list[Client]
     """
 
-    tid = client.cid  # Thread id and score key
+    with ACTIVE_GAMES.track():
+        game = Game(topic, players)
+        game_questions = question_set(topic, GL)  # get a random set of questions
 
-    # New client ids
-    client.cid = str(tid) + "-1"
-    match.cid = str(tid) + "-2"
+        for i, player in enumerate(game.players):  # wait for the threads of the other waiting players to stop reading
+            if player.host and not player.released.wait(TIMEOUT):
+                game.score[i] = "F"
+
+        prev_ans = None
+        for i, (qi, perm) in enumerate(game_questions):
+            correct = CORRECT[perm]  # Answers are ordered by the game's own permutation
+
+            if i == 0 and len(game.players) == 2:  # for the first question of a duel - send with the rival nickname
+                broadcast(game, functools.partial(frames.message, qi, perm, game.players[1].name), [0])
+                broadcast(game, functools.partial(frames.message, qi, perm, game.players[0].name), [1])
+            elif i == 0:  # for the first question in a room - send with the number of rivals
+                broadcast(game, functools.partial(frames.message, qi, perm, len(game.players) - 1))
+            else:  # for the rest - send with the answer of the previous question
+                broadcast(game, functools.partial(frames.message, qi, perm, prev_ans))
+
+            game.asked = monotonic()
+            prev_ans = correct
+
+            collect_answers(game, i, correct)  # get answer from all clients at the same time
+
+            sleep(QD)  # Slight delay between questions
+
+            game.drop_forfeited()
+            if len(game.players) < 2:  # Nobody left to play against
+                break
+        else:
+            GAMES_FINISHED.inc()
 
-    # Initialize score dict for the current game
-    with lock:
-        score[tid] = {
-            client.cid: 0,
-            match.cid: 0
-        }
+        # calculate and send game results to the remaining clients
+        if game.players:
+            broadcast(game, game.results(prev_ans))
 
-    game_questions = question_set(topic, GL)  # get a random set of questions
+        # keep their sessions open for another game
+        log(game.tid, f"Game ended. Resuming sessions and exiting thread.")
+        game.close()
+        for player in game.players:
+            resume_session(player)
+
+
+def resume_session(client) -> None:
+    """
+    Keeps a client connected once its game is over, and serves its next search query on a new thread.
+
+    :param client: client whose game is over
+    :type client: Client
+    """
+
+    client.reset()
+    client.thread = ServerThread(client.sock, client.addr, client.sid, client)
+    client.thread.start()
+
+
+# Asyncio engine
+cid_counter = itertools.count(1)  # Client id counter for the asyncio engine
+cid_prefix = ""  # Client id prefix - the worker id in multi-process mode
+
+
+async def recv_answer_async(game, i, correct) -> None:
+    """
+    Asyncio counterpart of collect_answers - gets an answer from a single client and adds score accordingly.
+    The task is canceled once the answer deadline has passed - see expire_answers.
+
+    :param game: current game
+    :param i: target player index
+    :param correct: correct answer
+    :type game: Game
+    :type i: int
+    :type correct: int
+    """
+
+    try:
+        msg = await game.players[i].recv(timeout=None)
+    except (asyncio.CancelledError, *RECV_ERRORS):  # No answer before the deadline, or a failed connection
+        msg = None
+
+    game.record_answer(i, msg, correct)
+
+
+async def broadcast_async(game, encode, players=None) -> None:
+    """
+    Asyncio counterpart of broadcast - the same bytes are written to every player before waiting for any of them.
+    Stream transports handle partial writes, and draining waits up to SEND_TIMEOUT for slow players.
+
+    :param game: current game
+    :param encode: function returning the encoded message in a given wire format version
+    :param players: indices of the target players, every player if None
+    :type game: Game
+    :type encode: function
+    :type players: list[int]
+    """
+
+    encoded = EncodedMessage(encode)
+    targets = range(0, len(game.players)) if players is None else players
+
+    for i in targets:
+        player = game.players[i]
+        msg, header = encoded[player.version]
+        if player.decoder is None:
+            player.writer.write(msg)
+        else:
+            player.writer.writelines((header, msg))
+
+    # Only writers past their buffer limit have to wait - the rest are done writing
+    slow = [i for i in targets if game.players[i].writer.transport.get_write_buffer_size() > OUT_LIMIT]
+    drained = await asyncio.gather(*(asyncio.wait_for(game.players[i].writer.drain(), SEND_TIMEOUT) for i in slow),
+                                   return_exceptions=True)
+    for i, result in zip(slow, drained):
+        if isinstance(result, Exception):
+            game.score[i] = "F"
+
+    if logger.traces(game.tid):
+        logger.write(game.tid, f">>>>> {encoded}")
+
+
+def expire_answers(answers) -> None:
+    """
+    Timer callback of an answer deadline in the asyncio engine - cancels the answer tasks still waiting.
+    Has to be called on the event loop.
 
-    prev_ans = None
-    for i in range(0, len(game_questions)):
-        q = game_questions.pop()
-        q.randomize()  # Randomize answers for the question
+    :param answers: answer tasks of the question
+    :type answers: list[asyncio.Task]
+    """
+
+    for task in answers:
+        task.cancel()
+
+
+async def match_clients_async(topic, client) -> bool:
+    """
+    Asyncio counterpart of match_clients.
+    Returns True if the client was handed over to a waiting client,
+    or False if it was added to the waiting list (or taken into a game meanwhile).
+    The event loop runs on a single thread, so the waiting list is accessed without the lock.
+    Waiting clients taken into a game are woken through their matched futures, and the task of the host
+    runs the game once all of them have stopped reading from their own streams.
+    With workers, waiting lists are held by the coordinator, and games are duels - see CoordinatorLink.
+
+    :param topic: chosen topic
+    :param client: current client
+    :type topic: str
+    :type client: AsyncClient
+    """
+
+    if topic not in TOPICS or topic not in waitlist.keys():
+        raise Error.Protocol.UnknownTopic
+
+    if client.host:  # Already taken into a game while handling this query
+        return False
+
+    if coordinator:
+        return await coordinator.match(topic, client)
+
+    members = waitlist[topic].room(client, room_size)
+
+    if not members:  # if there aren't enough waiting clients
+        # add to waiting list send 'N' message with time to wait before retrying
+        waitlist[topic].enqueue(client)
+        if client.matched is None:
+            client.matched = asyncio.get_running_loop().create_future()
+
+        log(client.cid, "Added to waitlist")
+        await client.send(encode_message("N", DW, version=client.version))
+        return False
+
+    # wake the waiting tasks - the host's task takes over this client and the rest of the room
+    host = members[0]
+    host.room = [client] + members[1:]
+    for member in members:
+        member.join(host)
+    return True
+
+
+async def join_game_async(topic, client) -> None:
+    """
+    Asyncio counterpart of join_game.
+
+    :param topic: game topic
+    :param client: current client
+    :type topic: str
+    :type client: AsyncClient
+    """
+
+    client.released.set()
+
+    if client.host is client:
+        await manage_game_async(topic, client.room + [client])
+    else:
+        log(client.cid, f"Game found, but managed by the host client's task. Closing task.")
+
+
+async def manage_game_async(topic, players) -> None:
+    """
+    Asyncio counterpart of manage_game.
+
+    :param topic: game topic
+    :param players: players of the game - the client that filled the room first, and the host last
+    :type topic: str
+    :type players: list[AsyncClient]
+    """
+
+    with ACTIVE_GAMES.track():
+        game = Game(topic, players)
+        game_questions = question_set(topic, GL)  # get a random set of questions
+
+        for i, player in enumerate(game.players):  # wait for the tasks of the other waiting players to stop reading
+            if player.host:
+                try:
+                    await asyncio.wait_for(player.released.wait(), TIMEOUT)
+                except asyncio.TimeoutError:
+                    game.score[i] = "F"
+
+        prev_ans = None
+        for i, (qi, perm) in enumerate(game_questions):
+            correct = CORRECT[perm]  # Answers are ordered by the game's own permutation
+
+            if i == 0 and len(game.players) == 2:  # for the first question of a duel - send with the rival nickname
+                await broadcast_async(game, functools.partial(frames.message, qi, perm, game.players[1].name), [0])
+                await broadcast_async(game, functools.partial(frames.message, qi, perm, game.players[0].name), [1])
+            elif i == 0:  # for the first question in a room - send with the number of rivals
+                await broadcast_async(game, functools.partial(frames.message, qi, perm, len(game.players) - 1))
+            else:  # for the rest - send with the answer of the previous question
+                await broadcast_async(game, functools.partial(frames.message, qi, perm, prev_ans))
+
+            game.asked = monotonic()
+            prev_ans = correct
+
+            # get answer from all clients at the same time, with a single deadline kept by the timer wheel
+            answers = [asyncio.ensure_future(recv_answer_async(game, p, correct))
+                       for p in range(0, len(game.players)) if game.score[p] != "F"]
+            timer = timers.schedule(TIMEOUT + ANS, asyncio.get_running_loop().call_soon_threadsafe, expire_answers, answers)
+            if answers:
+                await asyncio.wait(answers)
+            timers.cancel(timer)
+            await asyncio.sleep(QD)  # Slight delay between questions
+
+            game.drop_forfeited()
+            if len(game.players) < 2:  # Nobody left to play against
+                break
+        else:
+            GAMES_FINISHED.inc()
+
+        # calculate and send game results to the remaining clients
+        if game.players:
+            await broadcast_async(game, game.results(prev_ans))
+
+        # keep their sessions open for another game
+        log(game.tid, f"Game ended. Resuming sessions and exiting task.")
+        for player in game.players:
+            resume_session_async(player)
+
+
+def resume_session_async(client) -> None:
+    """
+    Asyncio counterpart of resume_session - serves the next search query of the client on a new task.
+
+    :param client: client whose game is over
+    :type client: AsyncClient
+    """
+
+    client.reset()
+    asyncio.ensure_future(handle_session_async(client))
+
+
+async def handle_session_async(client) -> None:
+    """
+    Session-handling logic of the asyncio engine - waits for the next search query of a client
+    that has finished a game.
+
+    :param client: current client
+    :type client: AsyncClient
+    """
+
+    timer = timers.schedule(IDLE, asyncio.get_running_loop().call_soon_threadsafe, client.expire)
+    msg = await client.recv(timeout=None)
+    timers.cancel(timer)
+
+    await search_async(client, msg)
+
+
+async def handle_client_async(reader, writer) -> None:
+    """
+    Client-handling logic of the asyncio engine - one task per connection.
+
+    :param reader: client stream reader
+    :param writer: client stream writer
+    :type reader: asyncio.StreamReader
+    :type writer: asyncio.StreamWriter
+    """
 
-        if i == 0:  # for the first question - send with the nickname of client's rival
-            send_message(client.sock, client.cid, build_message("Q", q.q, q.a1, q.a2, q.a3, q.a4, match.name))
-            send_message(match.sock, match.cid, build_message("Q", q.q, q.a1, q.a2, q.a3, q.a4, client.name))
-        else:  # for the rest - send with the answer of the previous question
-            msg = build_message("Q", q.q, q.a1, q.a2, q.a3, q.a4, prev_ans)
-            send_message(client.sock, client.cid, msg)
-            send_message(match.sock, match.cid, msg)
+    cid = cid_prefix + str(next(cid_counter))
+    addr = writer.get_extra_info("peername")
+    log(cid, f"New connection from {addr}")
+    OPEN_CONNECTIONS.inc()
+    msg, decoder = await recv_first_message_async(reader, cid)  # Get 'I' authentication message and wire mode
 
-        prev_ans = q.c
+    if not msg or msg.code != "I":
+        log(cid, f"Expected \"I\" query, instead got \"{msg.code if msg else None}\". Closing connection.", WARNING)
+        writer.close()
+        OPEN_CONNECTIONS.dec()
+        return
 
-        # get answer from both clients at the same time using threads
-        t1 = threading.Thread(target=recv_f, args=(tid, client, q.c))
-        t2 = threading.Thread(target=recv_f, args=(tid, match, q.c))
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
+    name = msg.fields[0]
+    client = AsyncClient(name, reader, writer, addr, cid, decoder, negotiate_version(msg, decoder))
 
-        sleep(0.2)  # Slight delay between questions
+    if not valid_nickname(name):
+        log(cid, "Invalid nickname, sending error message and closing connection.", WARNING)
+        await client.send(encode_message("E", "INV"))  # Send error message
+        client.close()
+        return
 
-        if score[tid][client.cid] == "F":  # Check if one of the clients has disconnected
-            log(tid, f"{client.cid} forfeited. Sending results and closing sockets.")
-            send_message(match.sock, match.cid, build_message("R", match.name, prev_ans))
-            client.sock.close()
-            match.sock.close()
+    # Send the bank sections the client doesn't hold and the welcome message, as a single batch -
+    # a section is compressed on first use, off the event loop
+    sync = await asyncio.to_thread(sync_messages, msg) if client.version == V2 else ()
+    await client.send(*sync, welcome_message(client))
+    await search_async(client, await client.recv())  # Get 'S' message (search for game)
+
+
+async def search_async(client, msg) -> None:
+    """
+    Searches a game for a client until it is matched, cancels or disconnects.
+
+    :param client: current client
+    :param msg: first search query
+    :type client: AsyncClient
+    :type msg: Message
+    """
+
+    cid = client.cid
+    topic = None
+
+    while msg and msg.code == "S":
+        topic = msg.fields[0]  # Save the topic which contains client in the waiting list
+        if client.searching is None:
+            client.searching = monotonic()
+
+        try:
+            matched = await match_clients_async(topic, client)
+        except (asyncio.TimeoutError, OSError):  # Failed to send 'N' - leave the waiting list as if disconnected
+            msg = None
+            break
+
+        if matched:
+            log(cid, f"Game found, but managed by the waiting client's task. Closing task.")
             return
 
-        elif score[tid][match.cid] == "F":
-            log(tid, f"{client.cid} forfeited. Sending results and closing sockets.")
-            send_message(client.sock, client.cid, build_message("R", client.name, prev_ans))
-            client.sock.close()
-            match.sock.close()
+        # Sleep until either another task takes this client into a game, or the client sends S/C again
+        query = asyncio.ensure_future(client.recv(timeout=None))
+        await asyncio.wait((query, client.matched), return_when=asyncio.FIRST_COMPLETED)
+
+        if client.host:
+            query.cancel()
+            await asyncio.wait((query,))  # Make sure the stream is released before the game reads from it
+            await join_game_async(topic, client)
+            return
+
+        try:
+            msg = query.result()
+        except RECV_ERRORS:  # Handled as a disconnection, so the client leaves the waiting list
+            msg = None
+
+    if msg and msg.code == "C":
+        log(cid, f"Client canceled game. Closing connection.")
+    elif msg is None:
+        log(cid, f"Client disconnected or idle. Closing connection.")
+    else:
+        log(cid, f"Expected \"S\" query, instead got \"{msg.code}\". Closing connection.", WARNING)
+
+    if topic:  # Remove client from waiting list
+        if coordinator:
+            coordinator.cancel(topic, client)
+        else:
+            waitlist[topic].cancel(client)
+
+        if client.host:  # Taken into a game at the same time - the game still has to be played
+            await join_game_async(topic, client)
             return
 
-    # calculate and send game results to both clients
-    if score[tid][client.cid] > score[tid][match.cid]:
-        msg = build_message("R", client.name, prev_ans)
-    elif score[tid][client.cid] < score[tid][match.cid]:
-        msg = build_message("R", match.name, prev_ans)
+    client.close()
+
+
+async def serve_async(reuse_port=False) -> None:
+    """
+    Asyncio engine accept loop - every connection is a task on a single event loop.
+
+    :param reuse_port: share the port with the other workers (SO_REUSEPORT)
+    :type reuse_port: bool
+    """
+
+    server = await asyncio.start_server(handle_client_async, "0.0.0.0", PORT, reuse_address=True, reuse_port=reuse_port)
+
+    if coordinator:
+        coordinator.start()
+        print(f"Worker {coordinator.worker} is online.")
     else:
-        msg = build_message("R", "B", prev_ans)
+        print("Server is online.")
+
+    async with server:
+        if coordinator:
+            await coordinator.closed  # Workers serve as long as the coordinator is up
+        else:
+            await server.serve_forever()
+
+
+# Multi-process mode
+class CoordinatorLink:
+    def __init__(self, conn, worker):
+        """
+        Worker side of the link to the matchmaking coordinator.
+        The coordinator holds the waiting lists of all workers, so clients of different workers can be matched.
+        A client matched with a client of another worker is moved to that worker,
+        by passing its socket over the link - see coordinate.
+
+        :param conn: duplex pipe to the coordinator process
+        :param worker: worker id
+        :type conn: multiprocessing.connection.Connection
+        :type worker: int
+        """
+
+        self.conn = conn
+        self.worker = worker
+        self.loop = None  # Worker event loop
+        self.closed = None  # Future resolved once the coordinator is gone
+        self.waiting = {}  # Waiting clients of this worker by client id
+        self.pending = {}  # Futures of unanswered coordinator requests by request id
+        self.rid = itertools.count()  # Request id counter
+
+    def start(self) -> None:
+        """
+        Starts receiving coordinator messages on a link thread,
+        which hands them to the event loop.
+        """
+
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self) -> None:
+        """
+        Link thread target function.
+        """
+
+        while True:
+            try:
+                msg = self.conn.recv()
+                if msg[0] == "adopt":
+                    msg = msg + (reduction.recv_handle(self.conn),)  # Passed client socket follows the message
+            except EOFError:  # Coordinator is gone - stop the worker
+                log(f"W{self.worker}", "Coordinator link closed.", ERROR)
+                self.loop.call_soon_threadsafe(self.closed.set_result, None)
+                return
+
+            self.loop.call_soon_threadsafe(self.dispatch, msg)
+
+    def dispatch(self, msg) -> None:
+        """
+        Handles a coordinator message on the event loop.
+
+        :param msg: coordinator message tuple
+        :type msg: tuple
+        """
+
+        if msg[0] == "adopt":
+            asyncio.ensure_future(self.adopt(*msg[1:]))
+            return
+
+        future = self.pending.pop(msg[1], None)
+        if future and not future.done():
+            future.set_result(msg)
+
+    async def match(self, topic, client) -> bool:
+        """
+        Coordinated counterpart of match_clients_async.
+
+        :param topic: chosen topic
+        :param client: current client
+        :type topic: str
+        :type client: AsyncClient
+        """
+
+        while True:
+            rid = next(self.rid)
+            self.pending[rid] = self.loop.create_future()
+            self.conn.send(("search", rid, topic, client.cid))
+            rsp = await self.pending[rid]
+
+            if rsp[0] == "wait":
+                # add to waiting list send 'N' message with time to wait before retrying
+                self.waiting[client.cid] = client
+                if client.matched is None:
+                    client.matched = self.loop.create_future()
+
+                log(client.cid, "Added to waitlist")
+                await client.send(encode_message("N", DW, version=client.version))
+                return False
+
+            self.waiting.pop(client.cid, None)
+
+            if rsp[0] == "local":  # The waiting client is on this worker
+                match = self.waiting.pop(rsp[2], None)
+                if match is None:  # Canceled meanwhile - search again
+                    continue
+
+                match.room = [client]
+                match.join(match)
+                return True
+
+            # The waiting client is on another worker - pass this client's socket to it
+            log(client.cid, f"Moving to worker {rsp[2]}.")
+            sock = client.writer.get_extra_info("socket")
+            self.conn.send(("handoff", rsp[2], rsp[3], topic, client.name, client.cid, client.decoder is not None,
+                            client.version, client.searching))
+            reduction.send_handle(self.conn, sock.fileno(), None)
+            client.close()  # The other worker holds its own copy of the socket
+            return True
+
+    def cancel(self, topic, client) -> None:
+        """
+        Removes a client from the coordinator waiting list.
+
+        :param topic: chosen topic
+        :param client: current client
+        :type topic: str
+        :type client: AsyncClient
+        """
+
+        self.waiting.pop(client.cid, None)
+        self.conn.send(("cancel", topic, client.cid))
+
+    async def adopt(self, waiter_cid, topic, name, cid, framed, version, searching, fd) -> None:
+        """
+        Takes over a client moved from another worker, and wakes the waiting client it was matched with.
+
+        :param waiter_cid: id of the waiting client on this worker
+        :param topic: chosen topic
+        :param name: nickname of the moved client
+        :param cid: id of the moved client
+        :param framed: whether the moved client uses framed messages
+        :param version: wire format version negotiated by the moved client
+        :param searching: time of the first search query of the moved client (monotonic, system-wide)
+        :param fd: file descriptor of the moved client socket
+        :type waiter_cid: str
+        :type topic: str
+        :type name: str
+        :type cid: str
+        :type framed: bool
+        :type version: int
+        :type searching: float
+        :type fd: int
+        """
+
+        sock = socket.socket(fileno=fd)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        client = AsyncClient(name, reader, writer, sock.getpeername(), cid, FrameDecoder() if framed else None, version)
+        client.searching = searching
+        OPEN_CONNECTIONS.inc()
+
+        waiter = self.waiting.pop(waiter_cid, None)
+        if waiter:
+            waiter.room = [client]
+            waiter.join(waiter)
+        else:  # Waiting client left meanwhile - search again from this worker
+            await search_async(client, Message("S", [topic]))
+
+
+def coordinate(conns) -> None:
+    """
+    Matchmaking coordinator main loop - holds the waiting lists of all workers.
+    Clients matched on the same worker are paired there.
+    Otherwise, the newly searching client's worker passes its socket through the coordinator
+    to the worker of the waiting client, whose task then runs the game.
+
+    :param conns: duplex pipes to the workers, by worker id - 1
+    :type conns: list[multiprocessing.connection.Connection]
+    """
+
+    queues = waitlist  # Waiting lists by topic - the global ones are unused in the coordinator process
+    entries = {}  # Waiting entries by (worker id, client id)
+    links = {conn: worker for worker, conn in enumerate(conns, 1)}
+    workers = {worker: conn for conn, worker in links.items()}
+
+    while links:
+        for conn in multiprocessing.connection.wait(list(links)):
+            worker = links[conn]
+            try:
+                msg = conn.recv()
+            except EOFError:  # Worker died - drop its waiting clients
+                log("C", f"Worker {worker} is offline.", ERROR)
+                del links[conn]
+                for key in [key for key in entries if key[0] == worker]:
+                    for queue in queues.values():
+                        queue.cancel(entries[key])
+                    del entries[key]
+                continue
+
+            if msg[0] == "search":
+                _, rid, topic, cid = msg
+                entry = entries.pop((worker, cid), None) or WaitingEntry((worker, cid), worker, cid)
+                match = queues[topic].dequeue(entry)
+
+                if not match:
+                    queues[topic].enqueue(entry)
+                    entries[entry.addr] = entry
+                    conn.send(("wait", rid))
+                else:
+                    del entries[match.addr]
+                    if match.worker == worker:
+                        conn.send(("local", rid, match.cid))
+                    else:
+                        conn.send(("transfer", rid, match.worker, match.cid))
+
+            elif msg[0] == "cancel":
+                _, topic, cid = msg
+                entry = entries.pop((worker, cid), None)
+                if entry:
+                    queues[topic].cancel(entry)
+
+            elif msg[0] == "handoff":
+                _, target, waiter_cid, topic, name, cid, framed, version, searching = msg
+                fd = reduction.recv_handle(conn)
+                workers[target].send(("adopt", waiter_cid, topic, name, cid, framed, version, searching))
+                reduction.send_handle(workers[target], fd, None)
+                os.close(fd)
+
+
+def worker_main(worker, conn, settings, inherited) -> None:
+    """
+    Worker process main function - runs the asyncio engine on the shared port.
+
+    :param worker: worker id
+    :param conn: duplex pipe to the coordinator process
+    :param settings: server settings dict
+    :param inherited: coordinator ends of the worker pipes, which have to be closed in the worker
+    so it sees the coordinator going away
+    :type worker: int
+    :type conn: multiprocessing.connection.Connection
+    :type settings: dict
+    :type inherited: list[multiprocessing.connection.Connection]
+    """
+
+    global coordinator, cid_prefix
+
+    for inherited_conn in inherited:
+        inherited_conn.close()
+
+    init_server(settings)
+    if settings["metrics"]:
+        serve_metrics(settings["metrics"] + worker)
+    coordinator = CoordinatorLink(conn, worker)
+    cid_prefix = f"{worker}."
+
+    raise_fd_limit()
+    asyncio.run(serve_async(reuse_port=True))
+
+
+def serve_workers(settings) -> None:
+    """
+    Starts the worker processes and runs the matchmaking coordinator.
+
+    :param settings: server settings dict
+    :type settings: dict
+    """
+
+    conns = []
+    for worker in range(1, settings["workers"] + 1):
+        conn, worker_conn = multiprocessing.Pipe()
+        conns.append(conn)
+        multiprocessing.Process(target=worker_main, args=(worker, worker_conn, settings, conns), daemon=True).start()
+        worker_conn.close()  # Only the worker holds its end
+
+    if settings["metrics"]:
+        serve_metrics(settings["metrics"])
+
+    print("Coordinator is online.")
+    coordinate(conns)
+
+
+# Metrics endpoint
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the process metrics in Prometheus text format on /metrics.
+    """
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = metrics.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        log("M", format % args, TRACE)
+
+
+def serve_metrics(port) -> None:
+    """
+    Serves the metrics endpoint on the local interface from a background thread,
+    and starts measuring encode and decode times.
+
+    :param port: endpoint port
+    :type port: int
+    """
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    metrics.enabled = True
+
+
+def parse_args(args) -> dict:
+    """
+    Parses server command line arguments -
+    [threaded|asyncio] [workers=N] [room=N] [debug] [log=LEVEL] [sample=N] [metrics=PORT]
+    and returns a settings dict.
+    Workers run the asyncio engine, so they can't be combined with the threaded engine,
+    and are only available where the port can be shared (SO_REUSEPORT) - not on Windows.
+    Games have up to room=N players (2 up to ROOM_MAX), but workers only match duels.
+    A game starts once its room is full, or with at least 2 players once one of them has waited ROOM_WAIT.
+    With workers, the coordinator serves its metrics on the metrics port, and every worker on the port after it
+    by worker id. Port 0 turns the metrics endpoint off.
+
+    :param args: command line arguments, without the program name
+    :type args: list[str]
+    :raises Error.Server.InvalidArgs: if an argument is not recognized
+    """
 
-    send_message(client.sock, client.cid, msg)
-    send_message(match.sock, match.cid, msg)
+    settings = {"mode": "threaded", "workers": 0, "room": 2, "debug": False, "log": INFO, "sample": 1,
+                "metrics": METRICS_PORT}
+
+    for arg in args:
+        if arg in SERVER_MODES:  # Server engine
+            settings["mode"] = arg
+        elif arg.startswith("workers=") and arg[8:].isdigit() and int(arg[8:]) > 0:  # Worker processes
+            settings["workers"] = int(arg[8:])
+        elif arg.startswith("room=") and arg[5:].isdigit() and 2 <= int(arg[5:]) <= ROOM_MAX:  # Players in a game
+            settings["room"] = int(arg[5:])
+        elif arg == "debug":  # Validate every built message
+            settings["debug"] = True
+        elif arg.startswith("log=") and arg[4:] in LOG_LEVELS:  # Lowest logged level, "trace" logs every message
+            settings["log"] = LOG_LEVELS.index(arg[4:])
+        elif arg.startswith("sample=") and arg[7:].isdigit() and int(arg[7:]) > 0:  # Log 1 of every N connections
+            settings["sample"] = int(arg[7:])
+        elif arg.startswith("metrics=") and arg[8:].isdigit():  # Metrics endpoint port
+            settings["metrics"] = int(arg[8:])
+        else:
+            raise Error.Server.InvalidArgs
+
+    if settings["workers"]:
+        if "threaded" in args or settings["room"] != 2 or not WORKERS:
+            raise Error.Server.InvalidArgs
+        settings["mode"] = "asyncio"
+
+    return settings
+
+
+def init_server(settings) -> None:
+    """
+    Loads the question bank, starts the timer wheel and applies the room size and protocol settings.
+
+    :param settings: server settings dict
+    :type settings: dict
+    """
 
-    # close client sockets
-    log(tid, f"Game ended. Closing sockets and exiting thread.")
-    client.sock.close()
-    match.sock.close()
+    global questions, frames, timers, room_size
+
+    room_size = settings["room"]
+    logger.level = settings["log"]
+    logger.sample = settings["sample"]
+
+    if settings["debug"]:
+        import protocol
+        protocol.DEBUG = True
+
+    questions = load_bank()
+    frames = QuestionFrames(questions)
+
+    timers = TimerWheel()
+    timers.start()
 
 
 def main():
-    global questions
-    questions = load_questions()
+    settings = parse_args(sys.argv[1:])
+
+    if settings["workers"]:
+        serve_workers(settings)
+        return
+
+    init_server(settings)
+    if settings["metrics"]:
+        serve_metrics(settings["metrics"])
+
+    if settings["mode"] == "asyncio":
+        raise_fd_limit()
+        asyncio.run(serve_async())
+        return
 
     # Create and bind the server main socket
     ss = socket.socket()
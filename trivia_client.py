@@ -0,0 +1,382 @@
+# Trivia - TCP Quiz Game POC [2.0.0]
+# By Martin Alebachew
+# TRIVIA_CLIENT.PY
+# #####
+
+from protocol import *
+from typing import Union
+import asyncio
+import os
+import socket
+
+# Client library constants
+SID = "S"  # Server representation in logs
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "trivia")  # Default question bank cache - see BankCache
+
+
+# Client library classes
+class BankCache:
+    def __init__(self, directory=CACHE_DIR):
+        """
+        On-disk cache of the server question bank, kept between launches,
+        so question texts are only transferred again once the server bank changes.
+        The bank is stored compiled and named by its digest, and mapped when loaded - see write_bank.
+
+        :param directory: cache directory, created on first store
+        :type directory: str
+        """
+
+        self.directory = directory
+
+    def load(self) -> Union[QuestionBank, None]:
+        """
+        Maps the cached bank, or returns None if there is none or it isn't named by its digest.
+        The digest comes from the section digests stored in the bank, so loading never hashes the questions.
+        """
+
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".bank")]
+            if not names:
+                return None
+
+            bank = map_questions(os.path.join(self.directory, names[0]))
+        except (OSError, Error.Protocol.InvalidQuestionBank):
+            return None
+
+        return bank if f"{bank.digest()}.bank" == names[0] else None
+
+    def store(self, bank) -> QuestionBank:
+        """
+        Writes a bank to the cache in place of the cached one, and returns it mapped from the cache.
+
+        :param bank: synced question bank
+        :type bank: QuestionBank
+        :raises OSError: if the bank can't be written
+        """
+
+        name = f"{bank.digest()}.bank"
+        path = os.path.join(self.directory, name)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_bank(path, {topic: bank.texts(topic) for topic in SECTIONS})
+
+        for old in os.listdir(self.directory):
+            if old.endswith(".bank") and old != name:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:  # Still mapped on Windows - replaced next time
+                    pass
+
+        return map_questions(path)
+
+
+class TriviaClient:
+    def __init__(self, name, ip="127.0.0.1", port=PORT, framed=True, bank=None, cache=None):
+        """
+        Headless client of the trivia protocol - connects to the server, searches games and answers questions.
+        Doesn't depend on any display, so the game client, bots and tools share it.
+        Methods that wait for the server return its response message, or None if none arrived in time.
+        A framed client with a question bank or a bank cache asks for the compact wire format,
+        where the server sends questions by index - they are resolved from the bank,
+        so received questions look the same in both formats.
+        The server first syncs the bank of such a client, sending only the sections that changed.
+
+        :param name: client nickname
+        :param ip: server IP address
+        :param port: server port
+        :param framed: use length-prefixed frames
+        :param bank: local copy of the server question bank, loaded from the cache if None
+        :param cache: question bank cache, kept in sync with the server bank
+        :type name: str
+        :type ip: str
+        :type port: int
+        :type framed: bool
+        :type bank: QuestionBank
+        :type cache: BankCache
+        """
+
+        self.name = name
+        self.ip = ip
+        self.port = port
+        self.decoder = FrameDecoder() if framed else None  # Connection frame decoder, None for an unframed connection
+        self.cache = cache
+        self.bank = bank if bank is not None or cache is None else cache.load()
+        self.version = V1  # Wire format version of the connection, negotiated in the handshake
+        self.sock = None  # Connection socket, kept open between games
+        self.out = None  # Connection output buffer
+
+    def connect(self) -> None:
+        """
+        Connects to the server and completes the handshake.
+
+        :raises Error.Client.ConnectionFailed: if the server can't be reached
+        :raises Error.Client.UnexpectedResponse: if the server didn't welcome the client
+        """
+
+        self.sock = socket.socket()
+        self.out = OutputBuffer(self.sock)
+
+        try:
+            self.sock.connect((self.ip, self.port))
+            self.send(*self.hello())
+            rsp = self.recv()
+
+            received = {}
+            while rsp and rsp.code == "B":  # Bank sections sent before the welcome message
+                received.setdefault(SECTIONS[rsp.fields[0]], []).append(rsp.fields[1])
+                rsp = self.recv()
+        except socket.error as e:
+            log(SID, "Error: {}".format(e), ERROR)
+            self.close()
+            raise Error.Client.ConnectionFailed
+
+        self.welcome(rsp, received)
+
+    def hello(self) -> list[Union[str, int]]:
+        """
+        Returns the code and fields of the 'I' authentication message -
+        with the compact wire format version, and the digests of the question bank and its sections
+        if the client can use that format. A client without a bank presents an empty digest.
+        """
+
+        if self.decoder is None or (self.bank is None and self.cache is None):
+            return ["I", self.name]
+        elif self.bank is None:
+            return ["I", self.name, V2, ""]
+        return ["I", self.name, V2, self.bank.digest()] + [f"{t}:{d}" for t, d in self.bank.sections().items()]
+
+    def welcome(self, rsp, received) -> None:
+        """
+        Checks the server response to the 'I' message, and switches to the wire format it confirmed.
+        Bank sections received before it are merged into the local bank, which is then cached.
+
+        :param rsp: server response
+        :param received: compressed chunks of the received bank sections by topic
+        :type rsp: Union[Message, None]
+        :type received: dict[str, list[bytes]]
+        :raises Error.Client.UnexpectedResponse: if the server didn't welcome the client,
+        or the synced bank doesn't match the server bank
+        """
+
+        if not rsp or rsp.code != "W":
+            self.close()
+            raise Error.Client.UnexpectedResponse
+
+        if rsp.fields[:1] != [str(V2)]:
+            self.version = V1
+            return
+
+        try:
+            bank = merge_bank(self.bank, received) if received else self.bank
+        except Error.Protocol.InvalidQuestionBank:
+            bank = None
+
+        if bank is None or rsp.fields[1:2] != [bank.digest()]:
+            self.close()
+            raise Error.Client.UnexpectedResponse
+
+        if received and self.cache:
+            try:
+                bank = self.cache.store(bank)
+            except OSError as e:  # Keep playing with the synced bank in memory
+                log(SID, "Error: {}".format(e), ERROR)
+
+        self.bank = bank
+        self.version = V2
+
+    def alive(self) -> bool:
+        """
+        Checks without blocking that the server has not closed the connection, which is kept open between games.
+        """
+
+        if self.sock is None:
+            return False
+
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0)  # Non-blocking peek - MSG_DONTWAIT is not available on Windows
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) != b""
+        except BlockingIOError:  # Nothing to read - still connected
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.settimeout(timeout)
+
+    def send(self, code, *fields) -> None:
+        """
+        Sends a message to the server in the connection's wire mode.
+
+        :param code: message code
+        :param fields: additional fields
+        :type code: str
+        :type fields: Union[str, int]
+        """
+
+        send_message(self.sock, SID, encode_message(code, *fields, version=self.version), self.decoder is not None,
+                     self.out)
+
+    def recv(self, timeout=TIMEOUT) -> Union[Message, None]:
+        """
+        Receives a message from the server.
+
+        :param timeout: recv timeout, None to wait indefinitely
+        :type timeout: Union[float, int, None]
+        """
+
+        return self.resolve(recv_message(self.sock, SID, timeout, self.decoder))
+
+    def resolve(self, msg) -> Union[Message, None]:
+        """
+        Replaces the question index and permutation id of a compact question message with the question texts,
+        as they are sent in the text format.
+
+        :param msg: received message
+        :type msg: Union[Message, None]
+        """
+
+        if msg and msg.code == "Q" and self.version == V2:
+            index, perm, last = msg.fields
+            q = self.bank.question(index, perm)
+            msg.fields = [q.q, q.a1, q.a2, q.a3, q.a4, last]
+        return msg
+
+    def search(self, topic, timeout=TIMEOUT) -> Union[Message, None]:
+        """
+        Searches a game in a given topic, and returns the server response -
+        the first question ("Q") if matched right away, whose last field is the rival nickname
+        (or the number of rivals in a room of more than two players),
+        or a wait message ("N") with the time to wait for a match before searching again.
+
+        :param topic: chosen topic
+        :param timeout: recv timeout
+        :type topic: str
+        :type timeout: Union[float, int]
+        """
+
+        self.send("S", topic)
+        return self.recv(timeout)
+
+    def cancel(self) -> None:
+        """
+        Cancels the current search. The server closes canceled connections, so the client is closed as well.
+        """
+
+        self.send("C")
+        self.close()
+
+    def answer(self, ans, timeout=TIMEOUT + ANS) -> Union[Message, None]:
+        """
+        Answers the current question, and returns the next question ("Q") or the game results ("R").
+        The last field of both is the correct answer of the current question.
+
+        :param ans: chosen answer (1-4), 0 if none chosen
+        :param timeout: recv timeout
+        :type ans: int
+        :type timeout: Union[float, int]
+        """
+
+        self.send("A", ans)
+        return self.recv(timeout)
+
+    def outcome(self, results) -> str:
+        """
+        Returns the outcome of a game for this client - "winner", "tie" or "loser".
+
+        :param results: game results message ("R")
+        :type results: Message
+        """
+
+        if results.fields[0] == self.name:
+            return "winner"
+        elif results.fields[0] == "B":
+            return "tie"
+        return "loser"
+
+    def close(self) -> None:
+        """
+        Closes the connection, if open.
+        """
+
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+        self.out = None
+        self.version = V1
+
+
+class AsyncTriviaClient(TriviaClient):
+    def __init__(self, name, ip="127.0.0.1", port=PORT, framed=True, bank=None, cache=None):
+        """
+        Asyncio counterpart of TriviaClient, so a single event loop can run thousands of clients.
+
+        :param name: client nickname
+        :param ip: server IP address
+        :param port: server port
+        :param framed: use length-prefixed frames
+        :param bank: local copy of the server question bank, loaded from the cache if None
+        :param cache: question bank cache, kept in sync with the server bank
+        :type name: str
+        :type ip: str
+        :type port: int
+        :type framed: bool
+        :type bank: QuestionBank
+        :type cache: BankCache
+        """
+
+        super().__init__(name, ip, port, framed, bank, cache)
+        self.reader = None
+        self.writer = None
+
+    async def connect(self) -> None:
+        """
+        Connects to the server and completes the handshake.
+
+        :raises Error.Client.ConnectionFailed: if the server can't be reached
+        :raises Error.Client.UnexpectedResponse: if the server didn't welcome the client
+        """
+
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.ip, self.port)
+            await self.send(*self.hello())
+            rsp = await self.recv()
+
+            received = {}
+            while rsp and rsp.code == "B":  # Bank sections sent before the welcome message
+                received.setdefault(SECTIONS[rsp.fields[0]], []).append(rsp.fields[1])
+                rsp = await self.recv()
+        except OSError as e:
+            log(SID, "Error: {}".format(e), ERROR)
+            self.close()
+            raise Error.Client.ConnectionFailed
+
+        self.welcome(rsp, received)
+
+    def alive(self) -> bool:
+        return self.writer is not None and not self.reader.at_eof()
+
+    async def send(self, code, *fields) -> None:
+        await send_message_async(self.writer, SID, encode_message(code, *fields, version=self.version),
+                                 self.decoder is not None)
+
+    async def recv(self, timeout=TIMEOUT) -> Union[Message, None]:
+        return self.resolve(await recv_message_async(self.reader, SID, timeout, self.decoder))
+
+    async def search(self, topic, timeout=TIMEOUT) -> Union[Message, None]:
+        await self.send("S", topic)
+        return await self.recv(timeout)
+
+    async def cancel(self) -> None:
+        await self.send("C")
+        self.close()
+
+    async def answer(self, ans, timeout=TIMEOUT + ANS) -> Union[Message, None]:
+        await self.send("A", ans)
+        return await self.recv(timeout)
+
+    def close(self) -> None:
+        if self.writer:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        self.version = V1